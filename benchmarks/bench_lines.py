@@ -0,0 +1,86 @@
+"""
+线路合并微基准: 对比 ChannelLines 与原先的字典列表线性查找, 以及限制线路数量(limit=10, reserve=5)时的内存
+
+    python benchmarks/bench_lines.py [线路数] [频道数] [每频道地址数]
+"""
+import os
+import sys
+import time
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iptv import ChannelLines
+
+
+def gen_corpus(total, channels, mirrors):
+    rnd = random.Random(3)
+    corpus = []
+    for i in range(total):
+        c = int(rnd.paretovariate(1.2)) % channels
+        m = rnd.randrange(mirrors)
+        host = f'[2409:8087:{m:x}::{c:x}]' if m % 5 == 0 else f'10.{c % 256}.{m // 256}.{m % 256}'
+        corpus.append((f'频道{c}', f'http://{host}:8080/live/{c}/{m}.m3u8', rnd.random()))
+    return corpus
+
+
+def legacy_ingest(corpus):
+    channels = {}
+    for name, url, response_time in corpus:
+        lines = channels.setdefault(name, [])
+        for u in lines:
+            if u['uri'] == url:
+                u['count'] = u['count'] + 1
+                u['priority'] = u['count']
+                u['response_time'] = min(u['response_time'], response_time)
+                break
+        else:
+            lines.append({'uri': url, 'priority': 1, 'count': 1, 'response_time': response_time})
+    return channels
+
+
+def store_ingest(corpus, limit=None, reserve=0):
+    channels = {}
+    for name, url, response_time in corpus:
+        lines = channels.get(name)
+        if lines is None:
+            lines = channels[name] = ChannelLines(limit, reserve)
+        lines.add(url, 0, response_time, url[7] == '[')
+    return channels
+
+
+def bounded_ingest(corpus):
+    return store_ingest(corpus, 10, 5)
+
+
+def measure(func, corpus):
+    start = time.perf_counter()
+    channels = func(corpus)
+    elapsed = time.perf_counter() - start
+    del channels
+    tracemalloc.start()
+    channels = func(corpus)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return channels, elapsed, current
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    channel_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    mirrors = int(sys.argv[3]) if len(sys.argv) > 3 else 400
+    corpus = gen_corpus(total, channel_count, mirrors)
+    print(f'线路数: {total}, 频道数: {channel_count}, 每频道地址数: {mirrors}')
+    mems = {}
+    for name, func in (('legacy', legacy_ingest), ('store', store_ingest), ('bounded', bounded_ingest)):
+        channels, elapsed, mem = measure(func, corpus)
+        unique = sum(len(l) for l in channels.values())
+        mems[name] = mem
+        print(f'{name:>8}: 去重后 {unique} 条, {elapsed:.3f}s, {total / elapsed:,.0f} 线路/s, 内存 {mem / 1024 / 1024:.1f}MB')
+    # 限制线路数量时被淘汰的线路记录有上限, 内存不应超过不限制时
+    assert mems['bounded'] < mems['store'], mems
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+播放列表解析微基准: 对比流式解析器与原先的逐行正则解析
+
+    python benchmarks/bench_playlist.py [条目数]
+"""
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from playlist import PlaylistParser, DEF_CHUNK_SIZE
+
+
+def gen_m3u(count):
+    lines = ['#EXTM3U x-tvg-url="https://example.com/epg.xml"']
+    for i in range(count):
+        lines.append(f'#EXTINF:-1 tvg-id="CCTV{i % 17}" tvg-name="CCTV{i % 17}" tvg-logo="https://example.com/{i % 17}.png" group-title="央视频道",CCTV-{i % 17} HD')
+        lines.append(f'http://192.168.{i % 255}.{i % 253}:8080/live/{i}/index.m3u8')
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def iter_chunks(body):
+    for i in range(0, len(body), DEF_CHUNK_SIZE):
+        yield body[i:i + DEF_CHUNK_SIZE]
+
+
+def legacy_parse(body):
+    # 原 fetch_sources 中的解析循环, 仅将 add_channel_uri 替换为收集结果
+    out = []
+    lines = body.splitlines()
+    is_m3u = any('#EXTINF' in l.decode() for l in lines[:10])
+    cur_cate = None
+    for line in lines:
+        line = line.decode().strip()
+        if not line:
+            continue
+        if is_m3u:
+            if line.startswith("#EXTINF"):
+                match = re.search(r'group-title="(.*?)",(.*)', line)
+                if match:
+                    cur_cate = match.group(1).strip()
+                    chl_name = match.group(2).strip()
+            elif not line.startswith("#"):
+                out.append((cur_cate, chl_name, line.strip()))
+        else:
+            if "#genre#" in line:
+                cur_cate = line.split(",")[0].strip()
+            elif cur_cate:
+                match = re.match(r"^(.*?),(.*?)$", line)
+                if match:
+                    out.append((cur_cate, match.group(1).strip(), match.group(2).strip()))
+    return len(out)
+
+
+def streaming_parse(body):
+    count = 0
+    for _ in PlaylistParser(iter_chunks(body)):
+        count += 1
+    return count
+
+
+def measure(func, body):
+    # 计时与内存分开测量, 避免 tracemalloc 的开销影响计时
+    start = time.perf_counter()
+    count = func(body)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    body = gen_m3u(count)
+    print(f'条目数: {count}, 大小: {len(body) / 1024 / 1024:.1f}MB')
+    for name, func in (('legacy', legacy_parse), ('streaming', streaming_parse)):
+        n, elapsed, peak = measure(func, body)
+        print(f'{name:>10}: {n} 条, {elapsed:.3f}s, {n / elapsed:,.0f} 条/s, 峰值内存 {peak / 1024:,.0f}KB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+"""
+基准测试: 生成合成的 M3U/TXT 播放列表与 XMLTV 数据, 由本地 HTTP 服务提供(可设置延迟与失败),
+分阶段计时并输出 JSON, 便于在不同提交之间对比
+
+    python benchmarks/harness.py [--entries N] [--sources N] [--output result.json] [--compare base.json]
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_canonical = (
+    [f'CCTV{i}' for i in range(1, 18)] + ['CCTV5+', 'CGTN'] +
+    [f'CETV{i}' for i in range(1, 5)] +
+    [f'{p}卫视' for p in ('湖南', '浙江', '东方', '北京', '江苏', '东南', '安徽', '山东', '天津', '四川', '广东', '深圳')] +
+    ['NewTV动作电影', 'NewTV惊悚悬疑', 'CHC高清电影', 'CHC家庭影院', '凤凰中文', '翡翠台', '明珠台']
+)
+
+
+def name_variants(name):
+    """
+    同一频道在各个源中常见的写法
+    """
+    variants = [name, f'{name} HD', f'{name}高清']
+    if name.startswith('CCTV') and name[4:].rstrip('+').isdigit():
+        variants += [f'CCTV-{name[4:]}', f'CCTV-{name[4:]} HD', f'{name}综合']
+    elif name.startswith('CETV'):
+        variants += [f'CETV-{name[4:]}', f'中国教育{name[4:]}台']
+    elif name.startswith(('NewTV', 'CHC')):
+        prefix = 'NewTV' if name.startswith('NewTV') else 'CHC'
+        variants += [f'{prefix.lower()} {name[len(prefix):]}', f'{prefix} {name[len(prefix):]} HD']
+    elif name == '凤凰中文':
+        variants += ['鳳凰衛視', '凤凰卫视']
+    elif name == '翡翠台':
+        variants += ['TVB翡翠', 'TVB 翡翠台']
+    return variants
+
+
+def gen_url(rnd, index):
+    r = rnd.random()
+    if r < 0.15:
+        return f'http://[2409:8087:{rnd.randrange(0xffff):x}::{rnd.randrange(0xff):x}]:80/live/{index}/index.m3u8'
+    if r < 0.25:
+        return f'https://cdn{rnd.randrange(50)}.example.com:443/hls/{index}.m3u8'
+    if r < 0.3:
+        return f'http://{rnd.randrange(1, 223)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(1, 255)}:8080/{index}.flv$线路{rnd.randrange(5)}'
+    return f'http://{rnd.randrange(1, 223)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(1, 255)}:{rnd.choice([80, 8080, 9901])}/live/{index}.m3u8'
+
+
+def gen_entries(count, seed=0, mirrors=8, extra_channels=200):
+    """
+    生成 (分类, 频道名, 地址), 同一地址会以不同写法的频道名出现在多个源中
+    """
+    rnd = random.Random(seed)
+    names = list(_canonical) + [f'地方频道{i}' for i in range(extra_channels)]
+    pool = [(name, gen_url(rnd, i * mirrors + m)) for i, name in enumerate(names) for m in range(mirrors)]
+    entries = []
+    for _ in range(count):
+        name, url = rnd.choice(pool)
+        cate = '央视频道' if name.startswith(('CCTV', 'CETV', 'CGTN')) else '其它'
+        entries.append((cate, rnd.choice(name_variants(name)), url))
+    return entries
+
+
+def render_m3u(entries):
+    lines = ['#EXTM3U']
+    for cate, name, url in entries:
+        lines.append(f'#EXTINF:-1 tvg-name="{name}" tvg-logo="https://example.com/logo/{name}.png" group-title="{cate}",{name}')
+        lines.append(url)
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def render_txt(entries):
+    lines = []
+    cate = None
+    for c, name, url in sorted(entries, key=lambda e: e[0]):
+        if c != cate:
+            cate = c
+            lines.append(f'{cate},#genre#')
+        lines.append(f'{name},{url}')
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def render_xmltv(channels, programmes_per_channel, seed=0):
+    rnd = random.Random(seed)
+    out = ['<?xml version="1.0" encoding="utf-8"?>', '<tv generator-info-name="bench" generator-info-url="http://127.0.0.1/">']
+    names = list(_canonical) + [f'无关频道{i}' for i in range(channels)]
+    for i, name in enumerate(names):
+        out.append(f'  <channel id="{i}"><display-name lang="zh">{name}</display-name></channel>')
+    # 从两天前开始, 部分节目落在默认的 EPG 时间窗口之外
+    base = int(time.time()) // 3600 * 3600 - 2 * 86400
+    for i in range(len(names)):
+        start = base
+        for _ in range(programmes_per_channel):
+            stop = start + rnd.choice([1800, 3600, 5400])
+            s = time.strftime('%Y%m%d%H%M%S +0000', time.gmtime(start))
+            e = time.strftime('%Y%m%d%H%M%S +0000', time.gmtime(stop))
+            out.append(f'  <programme channel="{i}" start="{s}" stop="{e}"><title lang="zh">节目{start}</title>'
+                       f'<desc lang="zh">简介 {"x" * 40}</desc></programme>')
+            start = stop
+    out.append('</tv>')
+    return ('\n'.join(out) + '\n').encode()
+
+
+class StandInServer:
+    """
+    本地 HTTP 服务, 提供内存中的文件, 可为每个路径设置延迟及失败
+    """
+    def __init__(self, files, latency=0.0, fail_paths=()):
+        self.files = files
+        self.latency = latency
+        self.fail_paths = set(fail_paths)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                if self.path in server.fail_paths:
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = server.files.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', f'"{hash(body) & 0xffffffff:x}"')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def measure(setup, run, memory=True):
+    """
+    分别测量耗时与内存: 计时时不开启 tracemalloc, 避免其开销影响结果
+    run 返回处理的条目数
+    """
+    state = setup()
+    start = time.perf_counter()
+    items = run(state)
+    seconds = time.perf_counter() - start
+    result = {'seconds': round(seconds, 6), 'items': items,
+              'items_per_sec': round(items / seconds, 1) if seconds > 0 else None}
+    if memory:
+        state = setup()
+        blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        run(state)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['peak_bytes'] = peak
+        result['net_blocks'] = sys.getallocatedblocks() - blocks
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    workdir = tempfile.mkdtemp(prefix='iptv-bench-')
+    entries = gen_entries(args.entries, seed=args.seed)
+    per_source = max(1, len(entries) // args.sources)
+    files = {}
+    for i in range(args.sources):
+        chunk = entries[i * per_source:(i + 1) * per_source]
+        if i % 2:
+            files[f'/src/{i}.txt'] = render_txt(chunk)
+        else:
+            files[f'/src/{i}.m3u'] = render_m3u(chunk)
+    fail_paths = [p for i, p in enumerate(sorted(files)) if args.fail_every and i % args.fail_every == args.fail_every - 1]
+    xmltv = render_xmltv(args.epg_channels, args.epg_programmes, seed=args.seed)
+    files['/epg.xml.gz'] = gzip.compress(xmltv)
+
+    with open(os.path.join(workdir, 'channel.txt'), 'w', encoding='utf-8') as fp:
+        fp.write('CATE: 央视频道\n' + '\n'.join(n for n in _canonical if n.startswith(('CCTV', 'CETV', 'CGTN'))) + '\n')
+        fp.write('CATE: 其它\n' + '\n'.join(n for n in _canonical if not n.startswith(('CCTV', 'CETV', 'CGTN'))) + '\n')
+        fp.write('\n'.join(f'地方频道{i}' for i in range(0, 200, 4)) + '\n')
+
+    with StandInServer(files, latency=args.latency, fail_paths=fail_paths) as server:
+        with open(os.path.join(workdir, 'config.ini'), 'w', encoding='utf-8') as fp:
+            fp.write('[config]\n')
+            fp.write(f'limit = {args.limit}\n')
+            fp.write('cache = false\nhealth = false\nprobe = false\n')
+            fp.write('channel_map =\n    中国教育1台 CETV1\n    凤凰卫视 凤凰中文\n    TVB翡翠 翡翠台\n    TVB翡翠台 翡翠台\n')
+            fp.write('blacklist =\n    cdn7.example.com\n    /live/13\\d\\.m3u8\n')
+            fp.write('source =\n' + ''.join(f'    {server.base_url}{p}\n' for p in sorted(files) if p.startswith('/src/')))
+            fp.write(f'epg_source =\n    {server.base_url}/epg.xml.gz\n')
+
+        os.environ['IPTV_CONFIG'] = os.path.join(workdir, 'config.ini')
+        os.environ['IPTV_CHANNEL'] = os.path.join(workdir, 'channel.txt')
+        os.environ['IPTV_DIST'] = os.path.join(workdir, 'dist')
+        os.environ['IPTV_CACHE'] = os.path.join(workdir, 'cache')
+        os.environ['EPG_CHANNEL_MAP'] = os.path.join(ROOT, 'epg.txt')
+
+        import logging
+        import iptv
+        import epg
+        from playlist import PlaylistParser
+        logging.getLogger().setLevel(logging.WARNING)
+
+        def new_iptv():
+            i = iptv.IPTV()
+            i.load_channels()
+            return i
+
+        def ingested():
+            i = new_iptv()
+            for _, name, url in entries:
+                i.add_channel_uri(name, url, 0.1)
+            return i
+
+        raw_names = [name for _, name, _ in entries]
+        m3u_body = render_m3u(entries)
+
+        def run_fetch(i):
+            i.fetch_sources()
+            return len(entries)
+
+        def run_parse(body):
+            return sum(1 for _ in PlaylistParser(body[n:n + 65536] for n in range(0, len(body), 65536)))
+
+        def run_clean(i):
+            for n in raw_names:
+                i.clean_channel_name(n)
+            return len(raw_names)
+
+        def run_normalize(i):
+            for n in raw_names:
+                i.normalize_channel_name(n)
+            return len(raw_names)
+
+        def run_ingest(i):
+            for _, name, url in entries:
+                i.add_channel_uri(name, url, 0.1)
+            return len(entries)
+
+        def run_sort(i):
+            i.sort_channels_by_response_time()
+            return sum(len(l) for l in i.channels.values())
+
+        def run_export(i):
+            if hasattr(i, 'export'):
+                i.export()
+            else:
+                i.export_m3u('live.m3u')
+                i.export_txt('live.txt')
+            return sum(len(l) for l in i.channels.values())
+
+        def new_epg():
+            e = epg.EPG()
+            e.iptv = new_iptv()
+            return e
+
+        def fetched_epg():
+            e = new_epg()
+            e.fetch_epg()
+            e.normalize()
+            return e
+
+        def run_epg_fetch(e):
+            e.fetch_epg()
+            return len(e.epg_doc.getroot()) if e.epg_doc is not None else 0
+
+        def run_epg_export(e):
+            e.export()
+            return len(e.epg_doc.getroot())
+
+        stages = {
+            'fetch_sources': (new_iptv, run_fetch),
+            'parse': (lambda: m3u_body, run_parse),
+            'clean_channel_name': (new_iptv, run_clean),
+            'normalize': (new_iptv, run_normalize),
+            'add_channel_uri': (new_iptv, run_ingest),
+            'sort': (ingested, run_sort),
+            'export': (ingested, run_export),
+            'epg_fetch': (new_epg, run_epg_fetch),
+            'epg_export': (fetched_epg, run_epg_export),
+        }
+        selected = args.stages.split(',') if args.stages else list(stages)
+        results = {}
+        for name in selected:
+            setup, run = stages[name]
+            results[name] = measure(setup, run, memory=not args.no_memory)
+            print(f'{name:>20}: {results[name]["seconds"]:.3f}s {results[name]["items_per_sec"] or 0:>14,.0f}/s',
+                  file=sys.stderr)
+
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'sizes': {'sources': args.sources, 'failed_sources': len(fail_paths), 'playlist_bytes': sum(len(v) for k, v in files.items() if k.startswith('/src/')),
+                  'epg_bytes': len(xmltv), 'epg_gz_bytes': len(files['/epg.xml.gz'])},
+        'stages': results,
+    }
+
+
+def compare(base, current):
+    for name, cur in current['stages'].items():
+        old = base.get('stages', {}).get(name)
+        if not old or not old.get('seconds'):
+            continue
+        ratio = cur['seconds'] / old['seconds']
+        mem = ''
+        if cur.get('peak_bytes') and old.get('peak_bytes'):
+            mem = f' 峰值内存 {cur["peak_bytes"] / old["peak_bytes"]:.2f}x'
+        print(f'{name:>20}: 耗时 {ratio:.2f}x{mem}', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IPTV/EPG 基准测试')
+    parser.add_argument('--entries', type=int, default=50000, help='播放列表条目总数')
+    parser.add_argument('--sources', type=int, default=20, help='源数量')
+    parser.add_argument('--fail-every', type=int, default=10, help='每 N 个源中有一个返回失败, 0 为不失败')
+    parser.add_argument('--latency', type=float, default=0.05, help='本地服务的响应延迟(秒)')
+    parser.add_argument('--limit', type=int, default=10, help='每个频道的线路数量限制')
+    parser.add_argument('--epg-channels', type=int, default=500, help='EPG 中无关频道的数量')
+    parser.add_argument('--epg-programmes', type=int, default=100, help='EPG 中每个频道的节目数量')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', default='', help='只运行指定阶段, 逗号分隔')
+    parser.add_argument('--no-memory', action='store_true', help='不测量内存')
+    parser.add_argument('--output', help='结果输出文件, 默认输出到标准输出')
+    parser.add_argument('--compare', help='与之前的结果文件对比')
+    args = parser.parse_args()
+
+    result = run_benchmarks(args)
+    data = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write(data)
+    else:
+        print(data)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fp:
+            compare(json.load(fp), result)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,51 +2,388 @@ import os
 import xml.etree.ElementTree as ET
 import datetime
 import gzip
+import zlib
+import itertools
+import time
+import bisect
+import contextlib
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 from pprint import pprint
 from io import StringIO, BytesIO
 
-from iptv import IPTV, logging, conv_dict, clean_inline_comment
+from iptv import IPTV, logging, conv_bool, conv_dict, conv_list, clean_inline_comment, atomic_write
+from playlist import DEF_CHUNK_SIZE
+from metrics import Metrics, timed
+from manifest import DigestWriter
 
 # 从环境变量中获取配置信息，如果未设置则使用默认值
 EPG_GZ_DISABLED = os.environ.get('EPG_GZ_DISABLED', False)
-EPG_SOURCE = os.environ.get('EPG_SOURCE', 'https://epg.v1.mk/fy.xml')
+EPG_GZ_LEVEL = int(os.environ.get('EPG_GZ_LEVEL', 9))
+# 多个源以逗号分隔, 未设置时使用 config.ini 中的 epg_source
+EPG_SOURCE = os.environ.get('EPG_SOURCE', '')
 EPG_CHANNEL_MAP = os.environ.get('EPG_CHANNEL_MAP', 'epg.txt')
 
 # 定义用于查找 EPG 信息名称和 URL 的键列表
 _info_name_keys = ['generator-info-name', 'info-name', 'source-info-name']
 _info_url_keys = ['generator-info-url', 'info-url', 'source-info-url']
 
+DEF_EPG_SOURCE = 'https://epg.v1.mk/fy.xml'
+DEF_EPG_FETCH_WORKERS = 4
+DEF_WRITE_BUFFER_SIZE = 64 * 1024
+DEF_EPG_WINDOW_BEFORE = 1
+DEF_EPG_WINDOW_AFTER = 3
+DEF_EPG_SHARD_DIR = 'epg'
+
+def iter_decompressed(chunks):
+    """
+    按块解压 gzip 数据, 非 gzip 数据原样返回
+    """
+    chunks = iter(chunks)
+    first = next(chunks, b'')
+    if not first.startswith(b'\x1f\x8b'):
+        if first:
+            yield first
+        yield from chunks
+        return
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    logging.info('EPG 解压中')
+    for chunk in itertools.chain([first], chunks):
+        while chunk:
+            yield d.decompress(chunk)
+            # 多段 gzip
+            chunk = d.unused_data if d.eof else b''
+            if chunk:
+                d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    yield d.flush()
+
+
+def parse_xmltv_time(value):
+    """
+    XMLTV 时间 (如 20240101120000 +0800, 时区前可无空格) 转为时间戳, 无时区按 UTC 处理
+    """
+    if not value:
+        return None
+    value = ''.join(value.split())
+    try:
+        if len(value) > 14:
+            return datetime.datetime.strptime(value, '%Y%m%d%H%M%S%z').timestamp()
+        return datetime.datetime.strptime(value[:14], '%Y%m%d%H%M%S').replace(tzinfo=datetime.timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+def is_overlapped(intervals, max_stops, start, stop):
+    """
+    intervals 为按开始时间排序的区间(可互相重叠), max_stops 为其结束时间的前缀最大值,
+    判断 [start, stop) 是否与其中任一区间重叠
+    """
+    if not intervals or start is None or stop is None:
+        return False
+    i = bisect.bisect_left(intervals, (stop,))
+    return i > 0 and max_stops[i - 1] > start
+
+
+class TeeWriter:
+    """
+    将写入的数据缓冲后同时写入多个文件
+    """
+    def __init__(self, *fps, buffer_size=DEF_WRITE_BUFFER_SIZE):
+        self.fps = fps
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._size = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.buffer_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        data = b''.join(self._buffer)
+        for fp in self.fps:
+            fp.write(data)
+        self._buffer = []
+        self._size = 0
+
+
+class ProgrammeIndex:
+    """
+    按频道分组并按开始时间排序的节目索引, 可按时间窗口二分查找裁剪
+    频道保持文档中的顺序, 没有有效开始时间的节目排在最前
+    时间无法解析的节目无法判断是否在窗口内, 裁剪时始终保留: 没有有效开始时间的节目全部保留,
+    没有有效结束时间的节目视为一直在播出
+    """
+    def __init__(self, root):
+        self.channels = OrderedDict()   # 频道 id => channel 元素
+        self.programmes = {}            # 频道 id => [(开始, 结束, programme 元素)]
+        self.starts = {}                # 频道 id => [开始], 用于二分查找
+        self.max_stops = {}             # 频道 id => [截至每个节目的最大结束时间], 用于查找开始于窗口之前但仍在播出的节目
+        for elem in root:
+            if elem.tag == 'channel':
+                self.channels[elem.get('id')] = elem
+            elif elem.tag == 'programme':
+                start = parse_xmltv_time(elem.get('start'))
+                stop = parse_xmltv_time(elem.get('stop'))
+                self.programmes.setdefault(elem.get('channel'), []).append(
+                    (float('-inf') if start is None else start, stop, elem))
+        for cid, items in self.programmes.items():
+            # 稳定排序, 开始时间相同的节目保持原有顺序
+            items.sort(key=lambda i: i[0])
+            self._set(cid, items)
+
+    def _set(self, cid, items):
+        self.programmes[cid] = items
+        self.starts[cid] = [i[0] for i in items]
+        self.max_stops[cid] = list(itertools.accumulate(
+            (float('inf') if i[1] is None else i[1] for i in items), max))
+
+    def _select(self, cid, start=None, end=None):
+        items = self.programmes.get(cid, [])
+        starts = self.starts.get(cid, [])
+        hi = len(items) if end is None else bisect.bisect_left(starts, end)
+        if start is None:
+            return items[:hi]
+        mid = min(hi, bisect.bisect_left(starts, start))
+        # 没有有效开始时间的节目排在最前, 全部保留
+        unparsed = bisect.bisect_right(starts, float('-inf'), 0, mid)
+        # 开始于窗口之前但仍在播出的节目: 长节目之后可能有已结束的短节目, 因此逐个判断结束时间;
+        # 最大结束时间不超过 start 的前缀中没有这样的节目, 不需要检查
+        lo = max(unparsed, bisect.bisect_right(self.max_stops.get(cid, []), start, 0, mid))
+        return (items[:unparsed] + [i for i in items[lo:mid] if i[1] is None or i[1] > start]
+                + items[mid:hi])
+
+    def get(self, cid, start=None, end=None):
+        """
+        频道在 [start, end) 内播出的节目元素
+        """
+        return [i[2] for i in self._select(cid, start, end)]
+
+    def prune(self, start=None, end=None):
+        """
+        只保留 [start, end) 内播出的节目, 返回移除的节目数量
+        """
+        removed = 0
+        for cid in list(self.programmes):
+            items = self.programmes[cid]
+            kept = self._select(cid, start, end)
+            if len(kept) < len(items):
+                removed += len(items) - len(kept)
+                self._set(cid, kept)
+        return removed
+
+    def __len__(self):
+        return sum(len(items) for items in self.programmes.values())
+
+    def to_root(self, tag, attrib, cids=None):
+        """
+        重建文档: 先是频道, 其后按频道及开始时间排列节目; cids 为只包含的频道
+        """
+        root = ET.Element(tag, dict(attrib))
+        full = cids is None
+        if full:
+            cids = list(self.channels)
+        root.extend(self.channels[cid] for cid in cids if cid in self.channels)
+        for cid in cids:
+            root.extend(i[2] for i in self.programmes.get(cid, []))
+        if full:
+            # 没有对应频道的节目放在最后
+            for cid, items in self.programmes.items():
+                if cid not in self.channels:
+                    root.extend(i[2] for i in items)
+        return root
+
+
 class EPG:
-    def __init__(self, *args, **kwargs):
-        # 初始化 IPTV 实例并加载频道信息
-        self.iptv = IPTV()
-        self.iptv.load_channels()
+    def __init__(self, iptv=None):
+        # 初始化 IPTV 实例并加载频道信息, 也可使用已加载的实例
+        if iptv is None:
+            iptv = IPTV()
+            iptv.load_channels()
+        self.iptv = iptv
         # 初始化 EPG 文档为 None
         self.epg_doc = None
+        self.source_url = None
+        # 文档头中的生成时间, 计算内容摘要时排除
+        self.generated_date = None
+        self.index = None
+        # 源指标中的 lines_* 为 EPG 元素数量
+        self.metrics = Metrics('epg')
 
-    def fetch_epg(self):
+    @property
+    def sources(self):
+        if EPG_SOURCE:
+            return [s.strip() for s in EPG_SOURCE.split(',') if s.strip()]
+        return self.iptv.get_config('epg_source', conv_list, default=[DEF_EPG_SOURCE])
+
+    def fetch_source(self, url):
         """
-        从指定的 URL 获取 EPG 数据，并进行解压和解析
+        从指定的 URL 获取 EPG 数据，边解压边解析
         """
-        url = EPG_SOURCE
         try:
             # 使用 IPTV 实例的 fetch 方法获取 EPG 数据
-            res = self.iptv.fetch(url)
+            stats = self.metrics.source(url)
+            res, stats.response_time = self.iptv.fetch(url)
             if res is None:
                 logging.error(f'EPG 获取失败: {url}')
-                return
+                return None
             logging.info(f'EPG 获取成功: {url}')
+            stats.from_cache = getattr(res, 'from_cache', False)
+            stats.timing = getattr(res, 'timing', None)
+            start_time = time.perf_counter()
             try:
-                # 尝试对获取的数据进行解压
-                content = gzip.decompress(res.content)
-                logging.info('EPG 解压成功')
-            except (gzip.BadGzipFile, AttributeError):
-                # 如果解压失败，使用原始数据
-                content = res.content
-            # 解析 XML 数据
-            self.epg_doc = ET.parse(BytesIO(content))
+                doc = self.parse_epg(iter_decompressed(stats.count_bytes(res.iter_content(DEF_CHUNK_SIZE))), stats)
+                stats.ok = True
+                return doc
+            finally:
+                res.close()
+                stats.parse_time = time.perf_counter() - start_time
+                self.metrics.add_time('parse', stats.parse_time)
         except Exception as e:
             logging.error(f'解析 EPG 出错: {url} {e}')
+        return None
+
+    @timed('fetch')
+    def fetch_epg(self):
+        """
+        并发获取所有 EPG 源, 按配置顺序(优先级)合并
+        """
+        sources = self.sources
+        self.epg_doc = None
+        if not sources:
+            logging.error('未配置 EPG 源')
+            return
+        with ThreadPoolExecutor(max_workers=min(len(sources), DEF_EPG_FETCH_WORKERS)) as executor:
+            docs = [(url, doc) for url, doc in zip(sources, executor.map(self.fetch_source, sources)) if doc is not None]
+        if not docs:
+            return
+        self.source_url = docs[0][0]
+        self.epg_doc = self.merge_epg([doc for _, doc in docs])
+
+    def parse_epg(self, chunks, stats=None):
+        """
+        流式解析 EPG, 解析过程中完成频道名转换及清理:
+        只保留 IPTV 频道列表中存在的频道及其节目, 其余元素解析完即丢弃
+        """
+        channel_map = self.load_channel_name_map()
+        wanted = self.iptv.channels
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        root = None
+        doc_root = None
+        reserved_ids = set()
+        depth = 0
+        total = 0
+
+        def _events():
+            for chunk in chunks:
+                parser.feed(chunk)
+                yield from parser.read_events()
+            parser.close()
+            yield from parser.read_events()
+
+        for event, elem in _events():
+            if event == 'start':
+                depth += 1
+                if root is None:
+                    root = elem
+                    doc_root = ET.Element(elem.tag, dict(elem.attrib))
+                continue
+
+            depth -= 1
+            # 只处理根节点的直接子元素
+            if depth != 1:
+                continue
+            total += 1
+            if elem.tag == 'channel':
+                if self._convert_channel_name(elem, channel_map) in wanted:
+                    reserved_ids.add(elem.get('id'))
+                    doc_root.append(elem)
+            elif elem.tag == 'programme':
+                if elem.get('channel') in reserved_ids:
+                    desc = elem.find('desc')
+                    if desc is not None:
+                        elem.remove(desc)
+                    doc_root.append(elem)
+            # 根节点下的元素随解析逐个移除, 每次移除都是 O(1)
+            root.remove(elem)
+
+        if doc_root is None:
+            raise ValueError('EPG 内容为空')
+        logging.info(f'EPG 解析完毕: 元素: {total} 保留: {len(doc_root)}')
+        if stats is not None:
+            stats.lines_parsed = total
+            stats.lines_accepted = len(doc_root)
+            stats.channels = set(c.findtext('display-name') for c in doc_root.iterfind('channel'))
+        return ET.ElementTree(doc_root)
+
+    @timed('merge')
+    def merge_epg(self, docs):
+        """
+        按优先级合并多个 EPG 文档:
+        高优先级源中没有的频道整体补充, 已有的频道只补充时间上不重叠的节目
+        节目以 (频道, 开始, 结束) 去重
+        """
+        if len(docs) == 1:
+            return docs[0]
+        base = docs[0].getroot()
+        merged = ET.Element(base.tag, dict(base.attrib))
+        channel_ids = {}        # 频道名 => 合并后的频道 id
+        intervals = {}          # 频道 id => (按开始时间排序的 [(开始, 结束)], 结束时间的前缀最大值)
+        seen = set()
+        channels = []
+        programmes = []
+        for index, doc in enumerate(docs):
+            root = doc.getroot()
+            id_map = {}
+            for channel in root.findall('channel'):
+                name = channel.findtext('display-name')
+                org_id = channel.get('id')
+                if name in channel_ids:
+                    id_map[org_id] = channel_ids[name]
+                    continue
+                cid = org_id
+                if cid in intervals:
+                    cid = f'{org_id}-{index}'
+                    channel.set('id', cid)
+                channel_ids[name] = id_map[org_id] = cid
+                intervals[cid] = ([], [])
+                channels.append(channel)
+
+            added = {}
+            for programme in root.findall('programme'):
+                cid = id_map.get(programme.get('channel'))
+                if cid is None:
+                    continue
+                start = parse_xmltv_time(programme.get('start'))
+                stop = parse_xmltv_time(programme.get('stop'))
+                # 无法解析的时间按原始字符串去重, 避免不同节目被当作重复丢弃
+                key = (cid,
+                       programme.get('start') if start is None else start,
+                       programme.get('stop') if stop is None else stop)
+                if key in seen:
+                    continue
+                if index and is_overlapped(*intervals[cid], start, stop):
+                    continue
+                seen.add(key)
+                programme.set('channel', cid)
+                programmes.append(programme)
+                if start is not None and stop is not None:
+                    added.setdefault(cid, []).append((start, stop))
+            # 本源的节目全部加入后才参与下一个源的重叠判断
+            for cid, items in added.items():
+                items = sorted(intervals[cid][0] + items)
+                intervals[cid] = (items, list(itertools.accumulate((i[1] for i in items), max)))
+            logging.info(f'EPG 合并: 源 {index + 1}, 频道: {len(channels)} 节目: {len(programmes)}')
+
+        merged.extend(channels)
+        merged.extend(programmes)
+        return ET.ElementTree(merged)
 
     def load_channel_name_map(self):
         """
@@ -65,54 +402,33 @@ class EPG:
             logging.error(f'频道名称映射文件 {EPG_CHANNEL_MAP} 未找到')
         return channel_map
 
-    def convert_channel_name(self):
+    def _convert_channel_name(self, channel, channel_map):
         """
-        根据加载的频道名称映射信息，转换 EPG 文档中的频道名称
+        根据加载的频道名称映射信息，转换频道元素中的频道名称
         """
-        if self.epg_doc is None:
-            logging.warning('EPG 文档未正确加载，无法进行频道名称转换')
-            return
-        channel_map = self.load_channel_name_map()
-        root = self.epg_doc.getroot()
-        for channel in root.findall('channel'):
-            display_name_ele = channel.find('display-name')
-            if display_name_ele is not None and display_name_ele.text in channel_map:
-                old_name = display_name_ele.text
-                new_name = channel_map[old_name]
-                logging.debug(f'映射频道名: {old_name} => {new_name}')
-                display_name_ele.text = new_name
+        display_name_ele = channel.find('display-name')
+        if display_name_ele is None:
+            return None
+        if display_name_ele.text in channel_map:
+            old_name = display_name_ele.text
+            new_name = channel_map[old_name]
+            logging.debug(f'映射频道名: {old_name} => {new_name}')
+            display_name_ele.text = new_name
+        return display_name_ele.text
 
+    @timed('cleanup')
     def cleanup(self):
         """
-        清理 EPG 文档中不存在于 IPTV 频道列表中的频道和节目信息
+        清理在解析时已完成, 这里只报告没有节目表的频道
         """
         if self.epg_doc is None:
             logging.warning('EPG 文档未正确加载，无法进行清理操作')
             return
-        del_channel_ids = []
-        reserved_channel_names = []
-        root = self.epg_doc.getroot()
-        for channel in root.findall('channel'):
-            display_name_ele = channel.find('display-name')
-            if display_name_ele is not None:
-                name = display_name_ele.text
-                if name not in self.iptv.channels.keys():
-                    del_channel_ids.append(channel.get('id'))
-                    root.remove(channel)
-                else:
-                    reserved_channel_names.append(name)
-
-        for programme in root.findall('programme'):
-            if programme.get('channel') in del_channel_ids:
-                root.remove(programme)
-            else:
-                desc = programme.find('desc')
-                if desc is not None:
-                    programme.remove(desc)
-
-        non_existed_channels = ', '.join([n for n in self.iptv.channels.keys() if n not in reserved_channel_names])
+        reserved = set(c.findtext('display-name') for c in self.epg_doc.getroot().findall('channel'))
+        non_existed_channels = ', '.join([n for n in self.iptv.channels.keys() if n not in reserved])
         logging.info(f'没有节目表的频道: {non_existed_channels}')
 
+    @timed('normalize')
     def normalize_extras(self):
         """
         规范化 EPG 文档的额外信息，如日期、生成器信息等
@@ -148,20 +464,113 @@ class EPG:
 
         root.attrib.clear()
         now = datetime.datetime.now(datetime.timezone.utc)
-        root.set('date', now.strftime('%Y%m%d%H%M%S +0000'))
+        self.generated_date = now.strftime('%Y%m%d%H%M%S +0000')
+        root.set('date', self.generated_date)
         root.set('generator-info-name', 'alantang1977/iptv_SuperD')
         root.set('generator-info-url', 'https://github.com/alantang1977/iptv_SuperD')
         root.set('source-info-name', info_name)
-        root.set('source-info-url', info_url or EPG_SOURCE)
+        root.set('source-info-url', info_url or self.source_url)
+
+    @timed('index')
+    def index_programmes(self):
+        """
+        建立按频道及开始时间排序的节目索引, 按 epg_window_before/epg_window_after (天) 裁剪节目, 并据此重建文档
+        """
+        if self.epg_doc is None:
+            return
+        root = self.epg_doc.getroot()
+        self.index = ProgrammeIndex(root)
+        before = self.iptv.get_config('epg_window_before', float, default=DEF_EPG_WINDOW_BEFORE)
+        after = self.iptv.get_config('epg_window_after', float, default=DEF_EPG_WINDOW_AFTER)
+        now = time.time()
+        # 小于 0 时不限制
+        start = now - before * 86400 if before >= 0 else None
+        end = now + after * 86400 if after >= 0 else None
+        total = len(self.index)
+        removed = self.index.prune(start, end)
+        logging.info(f'EPG 节目: {total}, 时间窗口外移除: {removed}')
+        self.metrics.set('programmes_pruned', removed)
+        self.epg_doc = ET.ElementTree(self.index.to_root(root.tag, root.attrib))
 
     def normalize(self):
         """
-        对 EPG 文档进行规范化处理，包括频道名称转换、清理和额外信息规范化
+        对 EPG 文档进行规范化处理，频道名称转换和清理已在解析时完成
         """
-        self.convert_channel_name()
         self.cleanup()
+        self.index_programmes()
         self.normalize_extras()
 
+    def channel_ids(self):
+        """
+        {频道名: EPG 频道 id}, 频道名已按 epg.txt 映射为规范频道名, 用于在播放列表中关联节目表
+        """
+        if self.epg_doc is None:
+            return {}
+        ids = {}
+        for channel in self.epg_doc.getroot().iterfind('channel'):
+            name = channel.findtext('display-name')
+            if name and name not in ids:
+                ids[name] = channel.get('id')
+        return ids
+
+    def iter_shards(self):
+        """
+        按频道拆分的 EPG, 返回 (文件名, 内容), 最后为索引 index.json:
+        [{"id", "name", "file", "programmes", "start", "stop"}], start/stop 为首个节目的开始及最后节目的结束时间
+        """
+        if self.epg_doc is None or self.index is None:
+            return
+        root = self.epg_doc.getroot()
+        entries = []
+        for cid, channel in self.index.channels.items():
+            filename = f'{quote(cid, safe="")}.xml'
+            buf = BytesIO()
+            shard = self.index.to_root(root.tag, root.attrib, [cid])
+            ET.indent(shard)
+            ET.ElementTree(shard).write(buf, encoding='utf-8', xml_declaration=True)
+            items = self.index.programmes.get(cid, [])
+            entries.append({
+                'id': cid,
+                'name': channel.findtext('display-name'),
+                'file': filename,
+                'programmes': len(items),
+                'start': items[0][2].get('start') if items else None,
+                'stop': items[-1][2].get('stop') if items else None,
+            })
+            yield filename, buf.getvalue()
+        yield 'index.json', json.dumps(entries, ensure_ascii=False, indent=2).encode('utf-8')
+
+    def export_shards(self, manifest=None):
+        """
+        在 dist/epg 中导出每个频道一个文件及索引, 便于客户端只加载需要的频道
+        不再存在的频道的文件会被删除; 指定 manifest 时内容未变化的文件不改写
+        """
+        if self.index is None:
+            return
+        volatile = f'date="{self.generated_date}"'.encode() if self.generated_date else None
+        names = set()
+        for filename, body in self.iter_shards():
+            names.add(filename)
+            with atomic_write(self.iptv.get_dist(f'{DEF_EPG_SHARD_DIR}/{filename}'), manifest=manifest, volatile=volatile) as fp:
+                fp.write(body)
+        shard_dir = os.path.dirname(self.iptv.get_dist(f'{DEF_EPG_SHARD_DIR}/index.json'))
+        for filename in os.listdir(shard_dir):
+            if filename.endswith(('.xml', '.json')) and filename not in names:
+                path = os.path.join(shard_dir, filename)
+                if manifest is not None:
+                    manifest.remove(path)
+                else:
+                    os.remove(path)
+        logging.info(f'导出按频道拆分的 EPG: {shard_dir}, 频道: {len(names) - 1}')
+
+    def serialize(self, fp):
+        """
+        序列化 EPG 文档, 按块直接写入 fp, 不生成整个文档的中间副本
+        """
+        root = self.epg_doc.getroot()
+        ET.indent(root)
+        ET.ElementTree(root).write(fp, encoding='utf-8', xml_declaration=True)
+
     def dumpb(self):
         """
         将 EPG 文档转换为字节流形式
@@ -169,9 +578,9 @@ class EPG:
         if self.epg_doc is None:
             logging.warning('EPG 文档未正确加载，无法进行字节流转换')
             return b''
-        root = self.epg_doc.getroot()
-        ET.indent(root)
-        return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+        buf = BytesIO()
+        self.serialize(buf)
+        return buf.getvalue()
 
     def dumps(self):
         """
@@ -179,35 +588,65 @@ class EPG:
         """
         return self.dumpb().decode()
 
-    def export_xml(self):
+    @timed('serialize')
+    def export(self, xml=True, xml_gz=True):
         """
-        将 EPG 文档导出为 XML 文件
+        一次序列化同时导出 XML 及压缩的 XML 文件（.xml.gz）, 均先写临时文件再替换; 设置 epg_shard 时另导出按频道拆分的文件
+        启用 manifest 时两者共用不含生成时间的 XML 内容摘要, 节目表没有变化时不改写; 返回有变化的文件
         """
         if self.epg_doc is None:
-            logging.warning('EPG 文档未正确加载，无法导出 XML 文件')
-            return
-        dst = self.iptv.get_dist('epg.xml')
+            logging.warning('EPG 文档未正确加载，无法导出文件')
+            return None
+        dsts = []
+        if xml:
+            dsts.append(self.iptv.get_dist('epg.xml'))
+        if xml_gz:
+            dsts.append(self.iptv.get_dist('epg.xml.gz'))
+        if not dsts:
+            return None
+        manifest = self.iptv.load_manifest(prefix='epg-')
+        digest = None
+        if manifest is not None:
+            volatile = f'date="{self.generated_date}"'.encode() if self.generated_date else None
+            digest = DigestWriter(volatile=volatile)
         try:
-            with open(dst, 'w', encoding='utf-8') as fp:
-                fp.write(self.dumps())
-            logging.info(f'导出 xml: {dst}')
+            with contextlib.ExitStack() as stack:
+                fps = []
+                if xml:
+                    fps.append(stack.enter_context(atomic_write(dsts[0], manifest=manifest, digest=digest)))
+                if xml_gz:
+                    gz_fp = stack.enter_context(atomic_write(dsts[-1], manifest=manifest, digest=digest))
+                    fps.append(stack.enter_context(gzip.GzipFile(filename='', mode='wb', fileobj=gz_fp,
+                                                                 compresslevel=EPG_GZ_LEVEL, mtime=0)))
+                if digest is not None:
+                    fps.append(digest)
+                # 文档头在第一次写入的数据块中, 其中的生成时间不会被拆分
+                tee = TeeWriter(*fps)
+                self.serialize(tee)
+                tee.flush()
+            for dst in dsts:
+                logging.info(f'导出 {"xml.gz" if dst.endswith(".gz") else "xml"}: {dst}')
+            if self.iptv.get_config('epg_shard', conv_bool, default=False):
+                self.export_shards(manifest)
         except Exception as e:
-            logging.error(f'导出 XML 文件时出错: {dst} {e}')
+            logging.error(f'导出 EPG 文件时出错: {dsts} {e}')
+            return None
+        if manifest is None:
+            return None
+        manifest.save()
+        return manifest.changed
+
+    def export_xml(self):
+        """
+        将 EPG 文档导出为 XML 文件
+        """
+        self.export(xml=True, xml_gz=False)
 
     def export_xml_gz(self):
         """
         将 EPG 文档导出为压缩的 XML 文件（.xml.gz）
         """
-        if self.epg_doc is None:
-            logging.warning('EPG 文档未正确加载，无法导出 XML.gz 文件')
-            return
-        dst = self.iptv.get_dist('epg.xml.gz')
-        try:
-            with open(dst, 'wb') as fp:
-                fp.write(gzip.compress(self.dumpb()))
-            logging.info(f'导出 xml.gz: {dst}')
-        except Exception as e:
-            logging.error(f'导出 XML.gz 文件时出错: {dst} {e}')
+        self.export(xml=False, xml_gz=True)
 
     def run(self):
         """
@@ -215,10 +654,12 @@ class EPG:
         """
         self.fetch_epg()
         self.normalize()
-        self.export_xml()
-
-        if not EPG_GZ_DISABLED:
-            self.export_xml_gz()
+        self.export(xml_gz=not EPG_GZ_DISABLED)
+        if self.epg_doc is not None:
+            root = self.epg_doc.getroot()
+            self.metrics.set('channels', len(root.findall('channel')))
+            self.metrics.set('programmes', len(root.findall('programme')))
+        self.iptv.export_metrics(self.metrics, prefix='epg-')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,230 @@
+import time
+import json
+import sqlite3
+import logging
+import statistics
+
+DEF_HEALTH_HISTORY = 5
+DEF_HEALTH_STALE = 20 * 3600
+DEF_HEALTH_DEAD_STREAK = 3
+DEF_HEALTH_DEAD_RETRY = 7 * 24 * 3600
+DEF_HEALTH_RETENTION = 30 * 24 * 3600
+DEF_BREAKER_THRESHOLD = 3
+DEF_BREAKER_COOLDOWN = 6 * 3600
+DEF_BREAKER_MAX_COOLDOWN = 7 * 24 * 3600
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half-open'
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS lines (
+    channel TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    probed_at REAL,
+    latencies TEXT NOT NULL DEFAULT '[]',
+    throughput REAL,
+    fail_streak INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (channel, uri)
+);
+CREATE TABLE IF NOT EXISTS line_sources (
+    channel TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    source TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (channel, uri, source)
+);
+'''
+
+_source_schema = '''
+CREATE TABLE IF NOT EXISTS sources (
+    url TEXT PRIMARY KEY,
+    fail_streak INTEGER NOT NULL DEFAULT 0,
+    last_success REAL,
+    last_failure REAL,
+    response_times TEXT NOT NULL DEFAULT '[]'
+);
+'''
+
+
+class LineHealth:
+    __slots__ = ('first_seen', 'last_seen', 'probed_at', 'latencies', 'throughput', 'fail_streak')
+
+    def __init__(self, first_seen, last_seen, probed_at=None, latencies=None, throughput=None, fail_streak=0):
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.probed_at = probed_at
+        self.latencies = latencies or []
+        self.throughput = throughput
+        self.fail_streak = fail_streak
+
+    @property
+    def latency(self):
+        return statistics.median(self.latencies) if self.latencies else None
+
+    def is_fresh(self, stale, now=None):
+        """
+        最近探测过且可用, 可直接复用上次的探测结果
+        """
+        now = now or time.time()
+        return self.probed_at is not None and self.fail_streak == 0 and now - self.probed_at < stale
+
+    def is_dead(self, streak, retry, now=None):
+        """
+        连续多次探测失败且未到重试时间, 可直接跳过
+        """
+        now = now or time.time()
+        return self.fail_streak >= streak and self.probed_at is not None and now - self.probed_at < retry
+
+
+class LineHealthStore:
+    """
+    线路健康记录, 保存在 SQLite 中, 以 (规范频道名, 地址) 为键
+    """
+    def __init__(self, path, history=DEF_HEALTH_HISTORY, retention=DEF_HEALTH_RETENTION):
+        self.path = path
+        self.history = history
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_schema)
+        self._lines = None
+        self.prune(retention)
+
+    def prune(self, retention):
+        before = time.time() - retention
+        with self.conn:
+            self.conn.execute('DELETE FROM lines WHERE last_seen < ?', (before,))
+            self.conn.execute('DELETE FROM line_sources WHERE last_seen < ?', (before,))
+
+    def _load(self):
+        if self._lines is None:
+            self._lines = {}
+            rows = self.conn.execute('SELECT channel, uri, first_seen, last_seen, probed_at, latencies, throughput, fail_streak FROM lines')
+            for channel, uri, first_seen, last_seen, probed_at, latencies, throughput, fail_streak in rows:
+                self._lines[(channel, uri)] = LineHealth(first_seen, last_seen, probed_at, json.loads(latencies),
+                                                         throughput, fail_streak)
+        return self._lines
+
+    def get(self, channel, uri):
+        return self._load().get((channel, uri))
+
+    def record_seen(self, source, counter, now=None):
+        """
+        记录一个源中出现的线路, counter 为 {(频道, 地址): 次数}
+        """
+        if not counter:
+            return
+        now = now or time.time()
+        lines = self._load()
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO lines (channel, uri, first_seen, last_seen) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (channel, uri) DO UPDATE SET last_seen = excluded.last_seen',
+                ((c, u, now, now) for c, u in counter))
+            self.conn.executemany(
+                'INSERT INTO line_sources (channel, uri, source, count, last_seen) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (channel, uri, source) DO UPDATE SET count = count + excluded.count, last_seen = excluded.last_seen',
+                ((c, u, source, n, now) for (c, u), n in counter.items()))
+        for key in counter:
+            health = lines.get(key)
+            if health is None:
+                lines[key] = LineHealth(now, now)
+            else:
+                health.last_seen = now
+
+    def record_probes(self, results, now=None):
+        """
+        记录探测结果, results 为 [(频道, 地址, 是否可用, 延迟, 吞吐量)]
+        """
+        now = now or time.time()
+        lines = self._load()
+        rows = []
+        for channel, uri, alive, latency, throughput in results:
+            health = lines.get((channel, uri))
+            if health is None:
+                health = lines[(channel, uri)] = LineHealth(now, now)
+            health.probed_at = now
+            if alive:
+                health.fail_streak = 0
+                if latency is not None:
+                    health.latencies = (health.latencies + [latency])[-self.history:]
+                health.throughput = throughput
+            else:
+                health.fail_streak += 1
+            rows.append((channel, uri, health.first_seen, health.last_seen, now, json.dumps(health.latencies),
+                         health.throughput, health.fail_streak))
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO lines (channel, uri, first_seen, last_seen, probed_at, latencies, throughput, fail_streak) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (channel, uri) DO UPDATE SET probed_at = excluded.probed_at, latencies = excluded.latencies, '
+                'throughput = excluded.throughput, fail_streak = excluded.fail_streak', rows)
+        logging.debug(f'记录线路探测结果: {len(rows)}')
+
+    def close(self):
+        self.conn.close()
+
+
+class SourceHealth:
+    __slots__ = ('url', 'fail_streak', 'last_success', 'last_failure', 'response_times')
+
+    def __init__(self, url, fail_streak=0, last_success=None, last_failure=None, response_times=None):
+        self.url = url
+        self.fail_streak = fail_streak
+        self.last_success = last_success
+        self.last_failure = last_failure
+        self.response_times = response_times or []
+
+    def state(self, threshold, cooldown, max_cooldown=DEF_BREAKER_MAX_COOLDOWN, now=None):
+        """
+        连续失败未达到阈值时正常获取; 达到后在冷却期内跳过(冷却时间随失败次数加倍), 冷却期后试探一次
+        """
+        if self.fail_streak < threshold or self.last_failure is None:
+            return BREAKER_CLOSED
+        now = now or time.time()
+        wait = min(cooldown * 2 ** (self.fail_streak - threshold), max_cooldown)
+        return BREAKER_OPEN if now - self.last_failure < wait else BREAKER_HALF_OPEN
+
+
+class SourceHealthStore:
+    """
+    源的获取记录, 用于按历史响应时间调整超时及熔断长期失败的源
+    只在主线程中读写, 获取线程只读取启动时加载的记录
+    """
+    def __init__(self, path, history=DEF_HEALTH_HISTORY):
+        self.path = path
+        self.history = history
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_source_schema)
+        self._sources = {}
+        for url, fail_streak, last_success, last_failure, response_times in self.conn.execute(
+                'SELECT url, fail_streak, last_success, last_failure, response_times FROM sources'):
+            self._sources[url] = SourceHealth(url, fail_streak, last_success, last_failure, json.loads(response_times))
+
+    def get(self, url):
+        return self._sources.get(url)
+
+    def record(self, url, ok, response_time=None, now=None):
+        now = now or time.time()
+        health = self._sources.get(url)
+        if health is None:
+            health = self._sources[url] = SourceHealth(url)
+        if ok:
+            health.fail_streak = 0
+            health.last_success = now
+            if response_time is not None:
+                health.response_times = (health.response_times + [response_time])[-self.history:]
+        else:
+            health.fail_streak += 1
+            health.last_failure = now
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sources (url, fail_streak, last_success, last_failure, response_times) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (url, health.fail_streak, health.last_success, health.last_failure, json.dumps(health.response_times)))
+        return health
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,362 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import logging
+import threading
+
+DEF_CACHE_MAX_SIZE = 256 * 1024 * 1024
+DEF_CACHE_MAX_AGE = 3600
+DEF_PARSED_MAX_AGE = 7 * 86400
+DEF_BATCH_GROUP = 1000
+# 解析结果的格式或频道名规范化规则变化时增加, 使旧的解析结果失效
+PARSED_BATCH_VERSION = 2
+
+
+class CachedResponse:
+    """
+    由缓存文件(或临时文件)构造的响应, 提供与 requests.Response 相同的常用接口
+    内容按块从文件读取, 不会整体载入内存
+    """
+    def __init__(self, url, fp, headers=None, status_code=200, from_cache=True, stale=False, fingerprint=None):
+        self.url = url
+        self.headers = headers or {}
+        self.status_code = status_code
+        self.from_cache = from_cache
+        # 获取失败时使用的过期缓存
+        self.stale = stale
+        self.timing = None
+        # 写入时计算的内容指纹, 未计算时为 None
+        self.fingerprint = fingerprint
+        self._fp = fp
+
+    @property
+    def content(self):
+        self._fp.seek(0)
+        return self._fp.read()
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        self._fp.seek(0)
+        while True:
+            chunk = self._fp.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def iter_lines(self, *args, **kwargs):
+        self._fp.seek(0)
+        for line in self._fp:
+            yield line.rstrip(b'\r\n')
+
+    def close(self):
+        self._fp.close()
+
+
+class CacheEntry:
+    __slots__ = ('url', 'key', 'etag', 'last_modified', 'stored_at', 'response_time', 'size', 'fingerprint', '_body_path')
+
+    def __init__(self, url, key, body_path, meta):
+        self.url = url
+        self.key = key
+        self.etag = meta.get('etag')
+        self.last_modified = meta.get('last_modified')
+        self.stored_at = meta.get('stored_at', 0)
+        self.response_time = meta.get('response_time', float('inf'))
+        self.size = meta.get('size', 0)
+        self.fingerprint = meta.get('fingerprint')
+        self._body_path = body_path
+
+    @property
+    def has_validators(self):
+        return bool(self.etag or self.last_modified)
+
+    @property
+    def age(self):
+        return time.time() - self.stored_at
+
+    def validators(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def as_meta(self):
+        return {
+            'url': self.url,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'stored_at': self.stored_at,
+            'response_time': self.response_time,
+            'size': self.size,
+            'fingerprint': self.fingerprint,
+        }
+
+    def read(self):
+        with open(self._body_path, 'rb') as fp:
+            return fp.read()
+
+    def response(self, stale=False):
+        return CachedResponse(self.url, open(self._body_path, 'rb'), stale=stale, fingerprint=self.fingerprint)
+
+
+class HTTPCache:
+    """
+    以 URL 为键的磁盘 HTTP 缓存, 保存 ETag/Last-Modified 与响应内容
+    超出容量时按最近使用时间淘汰
+    """
+    def __init__(self, path, max_size=DEF_CACHE_MAX_SIZE, max_age=DEF_CACHE_MAX_AGE, stale_if_error=True):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.stale_if_error = stale_if_error
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _key(self, url):
+        return hashlib.sha1(url.encode()).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.path, key)
+        return f'{base}.json', f'{base}.body'
+
+    def _write_atomic(self, path, data):
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp, path)
+
+    def get(self, url):
+        key = self._key(url)
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, encoding='utf-8') as fp:
+                meta = json.load(fp)
+            if not os.path.isfile(body_path) or meta.get('url') != url:
+                return None
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(url, key, body_path, meta)
+
+    def is_fresh(self, entry):
+        """
+        没有校验信息的源在 max_age 内直接复用缓存, 有校验信息的源始终发起条件请求
+        """
+        return not entry.has_validators and entry.age < self.max_age
+
+    def store(self, url, headers, chunks, response_time=None, fingerprint=None):
+        """
+        按块写入响应内容, chunks 可以是 bytes 或可迭代的数据块
+        fingerprint 为 playlist.Fingerprint 时在写入的同时计算内容指纹并保存
+        """
+        if isinstance(chunks, bytes):
+            chunks = [chunks]
+        if fingerprint is not None:
+            chunks = fingerprint.wrap(chunks)
+        key = self._key(url)
+        meta_path, body_path = self._paths(key)
+        tmp = f'{body_path}.{threading.get_ident()}.tmp'
+        size = 0
+        try:
+            with open(tmp, 'wb') as fp:
+                for chunk in chunks:
+                    fp.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp, body_path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        meta = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'stored_at': time.time(),
+            'response_time': response_time,
+            'size': size,
+            'fingerprint': fingerprint.hexdigest() if fingerprint is not None else None,
+        }
+        try:
+            self._write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode())
+        except OSError as e:
+            logging.warning(f'写入缓存失败: {url} {e}')
+        self.evict()
+        return CacheEntry(url, key, body_path, meta)
+
+    def touch(self, entry, response_time=None):
+        """
+        304 时刷新缓存的存储时间
+        """
+        meta_path, _ = self._paths(entry.key)
+        entry.stored_at = time.time()
+        if response_time is not None:
+            entry.response_time = response_time
+        try:
+            self._write_atomic(meta_path, json.dumps(entry.as_meta(), ensure_ascii=False).encode())
+        except OSError as e:
+            logging.warning(f'更新缓存失败: {entry.url} {e}')
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.path):
+                if not name.endswith('.body'):
+                    continue
+                path = os.path.join(self.path, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                meta_path = f'{path[:-5]}.json'
+                try:
+                    used = os.stat(meta_path).st_mtime
+                except OSError:
+                    used = st.st_mtime
+                entries.append((used, st.st_size, path, meta_path))
+                total += st.st_size
+
+            if total <= self.max_size:
+                return
+            for _, size, path, meta_path in sorted(entries):
+                for p in (meta_path, path):
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+                total -= size
+                logging.debug(f'淘汰缓存: {path}')
+                if total <= self.max_size:
+                    break
+
+
+class CachedBatch:
+    """
+    缓存的解析结果, 条目按组从文件中读取, 不会整体载入内存
+    """
+    def __init__(self, path, meta):
+        self.path = path
+        self.format = meta['format']
+        self.bytes = meta['bytes']
+        self.count = meta['count']
+
+    def __iter__(self):
+        with open(self.path, 'rb') as fp:
+            while True:
+                try:
+                    group = pickle.load(fp)
+                except EOFError:
+                    return
+                yield from group
+
+
+class BatchWriter:
+    """
+    在合并的同时按组写入解析结果, 全部写完后才写入元信息, 中途失败的结果不会被读取
+    """
+    def __init__(self, path, meta_path, group_size=DEF_BATCH_GROUP):
+        self.path = path
+        self.meta_path = meta_path
+        self.group_size = group_size
+        self._tmp = f'{path}.{threading.get_ident()}.tmp'
+        self._fp = open(self._tmp, 'wb')
+        self._group = []
+
+    def _flush(self):
+        if self._group:
+            pickle.dump(self._group, self._fp, protocol=pickle.HIGHEST_PROTOCOL)
+            self._group = []
+
+    def add(self, entry):
+        self._group.append(entry)
+        if len(self._group) >= self.group_size:
+            self._flush()
+
+    def finish(self, fmt, size, count):
+        try:
+            self._flush()
+            self._fp.close()
+            os.replace(self._tmp, self.path)
+            meta_tmp = f'{self.meta_path}.{threading.get_ident()}.tmp'
+            with open(meta_tmp, 'w', encoding='utf-8') as fp:
+                json.dump({'format': fmt, 'bytes': size, 'count': count}, fp)
+            os.replace(meta_tmp, self.meta_path)
+        except OSError as e:
+            logging.warning(f'写入解析结果缓存失败: {self.path} {e}')
+            self.abort()
+
+    def abort(self):
+        self._fp.close()
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+
+class ParsedBatchCache:
+    """
+    以内容指纹为键的解析结果缓存, 内容未变化的源(或与其它源内容相同)直接复用上次解析及规范化的结果
+    signature 为影响解析结果的配置(如频道名映射)的摘要, 配置变化后旧结果自动失效
+    结果按组读写, 内存占用与源大小无关
+    """
+    def __init__(self, path, signature='', max_age=DEF_PARSED_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.signature = f'{PARSED_BATCH_VERSION}:{signature}'
+        os.makedirs(path, exist_ok=True)
+
+    def _paths(self, digest):
+        key = hashlib.sha1(f'{self.signature}:{digest}'.encode()).hexdigest()
+        base = os.path.join(self.path, key)
+        return f'{base}.json', f'{base}.pickle'
+
+    def get(self, digest):
+        meta_path, path = self._paths(digest)
+        try:
+            with open(meta_path, encoding='utf-8') as fp:
+                batch = CachedBatch(path, json.load(fp))
+            if not os.path.isfile(path):
+                return None
+            os.utime(meta_path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.debug(f'读取解析结果缓存失败: {meta_path} {e}')
+            return None
+        return batch
+
+    def writer(self, digest):
+        meta_path, path = self._paths(digest)
+        try:
+            return BatchWriter(path, meta_path)
+        except OSError as e:
+            logging.warning(f'写入解析结果缓存失败: {path} {e}')
+            return None
+
+    def evict(self):
+        # 超过 max_age 未使用的结果(源已移除或内容已变化)
+        now = time.time()
+        for name in os.listdir(self.path):
+            if not name.endswith('.pickle'):
+                continue
+            path = os.path.join(self.path, name)
+            meta_path = f'{path[:-7]}.json'
+            try:
+                used = os.stat(meta_path).st_mtime
+            except OSError:
+                used = 0
+            if now - used <= self.max_age:
+                continue
+            for p in (meta_path, path):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            logging.debug(f'淘汰解析结果缓存: {path}')
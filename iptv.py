@@ -1,31 +1,66 @@
 import os
 from configparser import ConfigParser, NoOptionError
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 import re
-from urllib.parse import urlparse
+import gzip
+import xml.etree.ElementTree as ET
+from urllib.parse import urlparse, quote
 import logging
 import itertools
 import typing as t
 import json
 from datetime import datetime
-from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+import multiprocessing
+from functools import lru_cache
+from contextlib import contextmanager, ExitStack
+import threading
 import requests
 import zhconv
 import time
+import tempfile
+import heapq
+import random
+import hashlib
+
+from probe import StreamProber, DEF_PROBE_TIMEOUT, DEF_PROBE_WORKERS
+from http_cache import HTTPCache, CachedResponse, ParsedBatchCache, CachedBatch, DEF_CACHE_MAX_SIZE, DEF_CACHE_MAX_AGE, DEF_PARSED_MAX_AGE
+from playlist import PlaylistParser, Fingerprint, fingerprint, DEF_CHUNK_SIZE
+from matcher import UrlMatcher, load_pattern_file
+from health import LineHealthStore, DEF_HEALTH_STALE, DEF_HEALTH_DEAD_STREAK, DEF_HEALTH_DEAD_RETRY, DEF_HEALTH_RETENTION
+from health import SourceHealthStore, BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN, DEF_BREAKER_THRESHOLD, DEF_BREAKER_COOLDOWN
+from metrics import Metrics, timed
+from transport import Transport, parse_source_options, dns_cache, DEF_DNS_TTL
+from manifest import Manifest, DigestWriter
 
 DEBUG = os.environ.get('DEBUG') is not None
 IPTV_CONFIG = os.environ.get('IPTV_CONFIG') or 'config.ini'
 IPTV_CHANNEL = os.environ.get('IPTV_CHANNEL') or 'channel.txt'
 IPTV_DIST = os.environ.get('IPTV_DIST') or 'dist'
+IPTV_CACHE = os.environ.get('IPTV_CACHE') or 'cache'
 EXPORT_RAW = ConfigParser.BOOLEAN_STATES[os.environ.get('EXPORT_RAW', default=str(DEBUG)).lower()]
 EXPORT_JSON = ConfigParser.BOOLEAN_STATES[os.environ.get('EXPORT_JSON', default=str(DEBUG)).lower()]
 
 DEF_LINE_LIMIT = 10
+DEF_LINE_RESERVE = 5
 DEF_REQUEST_TIMEOUT = 100
+DEF_CONNECT_TIMEOUT = 10
+DEF_READ_TIMEOUT_MIN = 15
+DEF_TIMEOUT_FACTOR = 4
+DEF_FETCH_RETRIES = 2
+DEF_RETRY_BACKOFF = 1.0
+DEF_BREAKER_PROBE_TIMEOUT = 5
+DEF_FETCH_WORKERS = 16
+DEF_FETCH_PER_HOST = 4
+DEF_SPOOL_SIZE = 1024 * 1024
+DEF_NAME_CACHE_SIZE = 65536
+DEF_PARSE_WORKERS = 0
+DEF_PARSE_MIN_SIZE = 256 * 1024
 DEF_USER_AGENT = 'okhttp/4.12.0-iptv'
 DEF_INFO_LINE = 'https://gcalic.v.myalicdn.com/gc/wgw05_1/index.m3u8?contentid=2820180516001'
 DEF_EPG = 'https://raw.githubusercontent.com/JinnLynn/iptv/dist/epg.xml'
 DEF_IPV4_FILENAME_SUFFIX = '-ipv4'
+DEF_EXPORT_BUFFER = 1024 * 1024
 DEF_WHITELIST_PRIORITY = 10
 
 logging.basicConfig(
@@ -71,10 +106,236 @@ class OrderedSet(t.MutableSet[T]):
     def __repr__(self):
         return f"<OrderedSet {self}>"
 
+class LineRecord:
+    __slots__ = ('uri', 'priority', 'count', 'response_time', 'ipv6', 'latency', 'throughput', 'source')
+    _fields = __slots__[:-1]
+
+    def __init__(self, uri, priority=0, response_time=float('inf'), ipv6=False, source=None):
+        self.uri = uri
+        self.priority = priority + 1
+        self.count = 1
+        self.response_time = response_time
+        self.ipv6 = ipv6
+        self.latency = None
+        self.throughput = None
+        # 提供该线路的源, 多个源都提供(或未知)时为 None, 用于统计各源独有的线路
+        self.source = source
+
+    def merge(self, priority, response_time, source=None):
+        self.count += 1
+        self.priority = self.count + priority
+        if response_time < self.response_time:
+            self.response_time = response_time
+        if source != self.source:
+            self.source = None
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self._fields}
+
+    def __repr__(self):
+        return f'<LineRecord {self.uri} priority={self.priority} count={self.count} response_time={self.response_time}>'
+
+class ChannelLines:
+    """
+    单个频道的线路集合, 以地址为键合并重复线路, 迭代顺序为插入(或排序后)的顺序
+    设置 limit 时只保留最好的 limit + reserve 条线路(与导出排序一致: 响应时间优先, 其次优先级, 最后为首次出现的顺序),
+    多出的 reserve 条供探测剔除不可用线路后递补
+    被淘汰或未被接受的线路中最好的 capacity 条保留累计的出现次数及响应时间, 再次出现时按累计结果重新比较;
+    每个频道出现的不同地址不超过 2 * capacity 时结果与不限制时一致, 更多时更差的线路再次出现只按本次计数(近似),
+    以此换取内存只与 频道数 * capacity 相关, 与线路总数无关
+    """
+    __slots__ = ('_lines', '_heap', '_seq', '_seqs', '_floor', '_evicted', '_evicted_heap', 'limit', 'capacity')
+
+    def __init__(self, limit=None, reserve=0):
+        self._lines = {}
+        self._heap = []
+        self._seq = 0
+        # 保留的线路首次出现的顺序, 及当前最差的保留线路 (排序, 地址), None 为需要重新查找
+        self._seqs = {}
+        self._floor = None
+        # 被淘汰的线路 {地址: (线路, 首次出现的顺序, 堆中的条目)}, 最多 capacity 条
+        self._evicted = {}
+        self._evicted_heap = []
+        self.limit = limit or None
+        self.capacity = self.limit + max(0, reserve) if self.limit else None
+
+    @staticmethod
+    def _rank(priority, response_time):
+        # 越小越差, 堆顶即最差的线路
+        return (-response_time, priority)
+
+    def _worst(self):
+        # 堆中的键只会变好(合并后优先级升高/响应时间降低), 因此过期的条目只需在堆顶时修正
+        # 结果在最差的线路合并、接受新线路或移除线路前不变
+        if self._floor is not None:
+            return self._floor
+        while self._heap:
+            neg_time, priority, neg_seq, uri = self._heap[0]
+            line = self._lines.get(uri)
+            if line is None or self._seqs.get(uri) != -neg_seq:
+                heapq.heappop(self._heap)
+                continue
+            rank = (*self._rank(line.priority, line.response_time), neg_seq)
+            if rank != (neg_time, priority, neg_seq):
+                heapq.heapreplace(self._heap, (*rank, uri))
+                continue
+            self._floor = rank, uri
+            return self._floor
+        return None, None
+
+    def _evicted_worst(self):
+        # 被淘汰的线路在 _evicted 中时不会合并, 排序不变; 已取出的条目在堆顶时丢弃
+        heap = self._evicted_heap
+        while heap:
+            entry = heap[0]
+            evicted = self._evicted.get(entry[-1])
+            if evicted is not None and evicted[2] is entry:
+                return entry[:-1]
+            heapq.heappop(heap)
+        return None
+
+    def _can_remember(self, rank):
+        return len(self._evicted) < self.capacity or rank > self._evicted_worst()
+
+    def _remember(self, uri, line, seq, rank):
+        # 调用前需确认 _can_remember, 已满时替换最差的一条
+        evicted = self._evicted
+        if len(evicted) >= self.capacity:
+            del evicted[heapq.heappop(self._evicted_heap)[-1]]
+        entry = (*rank, uri)
+        evicted[uri] = (line, seq, entry)
+        heapq.heappush(self._evicted_heap, entry)
+        if len(self._evicted_heap) > 4 * self.capacity:
+            self._evicted_heap = [e for _, _, e in evicted.values()]
+            heapq.heapify(self._evicted_heap)
+
+    def add(self, uri, priority=0, response_time=float('inf'), ipv6=None, source=None):
+        line = self._lines.get(uri)
+        if line is not None:
+            line.merge(priority, response_time, source)
+            if self._floor is not None and self._floor[1] == uri:
+                self._floor = None
+            return line
+
+        if not self.capacity:
+            line = self._lines[uri] = LineRecord(uri, priority, response_time,
+                                                 is_ipv6(uri) if ipv6 is None else ipv6, source)
+            return line
+
+        evicted = self._evicted.pop(uri, None)
+        if evicted is not None:
+            line, seq, _ = evicted
+            line.merge(priority, response_time, source)
+            rank = (*self._rank(line.priority, line.response_time), -seq)
+        else:
+            # 多数新线路不会被接受, 确认需要保留时才创建记录
+            self._seq += 1
+            seq = self._seq
+            rank = (*self._rank(priority + 1, response_time), -seq)
+        # 排序相同时先出现的线路更好
+        full = len(self._lines) >= self.capacity
+        if full:
+            worst_rank, worst_uri = self._worst()
+            if rank < worst_rank:
+                if self._can_remember(rank):
+                    if line is None:
+                        line = LineRecord(uri, priority, response_time, is_ipv6(uri) if ipv6 is None else ipv6, source)
+                    self._remember(uri, line, seq, rank)
+                return None
+        if line is None:
+            line = LineRecord(uri, priority, response_time, is_ipv6(uri) if ipv6 is None else ipv6, source)
+        if full:
+            heapq.heappop(self._heap)
+            worst = self._lines.pop(worst_uri)
+            worst_seq = self._seqs.pop(worst_uri)
+            if self._can_remember(worst_rank):
+                self._remember(worst_uri, worst, worst_seq, worst_rank)
+        heapq.heappush(self._heap, (*rank, uri))
+        self._lines[uri] = line
+        self._seqs[uri] = seq
+        self._floor = None
+        return line
+
+    def get(self, uri):
+        return self._lines.get(uri)
+
+    def clear(self):
+        self._lines = {}
+        self._heap = []
+        self._seq = 0
+        self._seqs = {}
+        self._floor = None
+        self._evicted = {}
+        self._evicted_heap = []
+
+    def remove(self, uri):
+        del self._lines[uri]
+        self._seqs.pop(uri, None)
+        self._floor = None
+
+    def sort(self, key):
+        lines = self._lines.values()
+        if self._seqs:
+            # 重新接受的线路按首次出现的顺序参与排序, 与不限制时的稳定排序一致
+            lines = sorted(lines, key=lambda l: self._seqs[l.uri])
+        self._lines = {l.uri: l for l in sorted(lines, key=key)}
+
+    def best(self, ipv4_only=False):
+        """
+        按当前顺序返回前 limit 条线路, 用于导出; ipv4_only 时跳过 IPv6 线路
+        """
+        lines = (l for l in self if not l.ipv6) if ipv4_only else iter(self)
+        if self.limit is None:
+            return lines
+        return itertools.islice(lines, self.limit)
+
+    def __contains__(self, uri):
+        return uri in self._lines
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __iter__(self) -> t.Iterator[LineRecord]:
+        return iter(self._lines.values())
+
+    def __repr__(self):
+        return f'<ChannelLines {len(self)}>'
+
+class RawLineWriter:
+    """
+    调试用: 将各源解析出的全部线路(含不需要的频道及黑名单中的线路)逐行写入 JSON Lines, 不在内存中保留
+    每个源先写一行 {"source": 序号, "url": 地址, "response_time": 响应时间},
+    其后每条线路为 [源序号, 映射后的原始名, 规范频道名, 地址, 结果], 结果为 accepted/unwanted/blacklisted
+    """
+    __slots__ = ('fp', 'source_index', 'count')
+
+    ACCEPTED = 'accepted'
+    UNWANTED = 'unwanted'
+    BLACKLISTED = 'blacklisted'
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.source_index = -1
+        self.count = 0
+
+    def begin_source(self, url, response_time):
+        self.source_index += 1
+        self.fp.write(json.dumps({'source': self.source_index, 'url': url,
+                                  'response_time': response_time if response_time != float('inf') else None},
+                                 ensure_ascii=False))
+        self.fp.write('\n')
+
+    def write(self, org_name, name, url, result):
+        self.count += 1
+        self.fp.write(json.dumps([self.source_index, org_name, name, url, result], ensure_ascii=False))
+        self.fp.write('\n')
+
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, set):
             return list(o)
+        if isinstance(o, ChannelLines):
+            return [l.as_dict() for l in o]
         return super().default(o)
 
 def json_dump(obj, fp=None, **kwargs):
@@ -83,6 +344,27 @@ def json_dump(obj, fp=None, **kwargs):
     kwargs.setdefault('ensure_ascii', False)
     return json.dump(obj, fp, **kwargs) if fp else json.dumps(obj, **kwargs)
 
+@contextmanager
+def atomic_write(path, mode='wb', manifest=None, digest=None, volatile=None, **kwargs):
+    # 先写入临时文件, 完成后再替换, 读取方不会看到写了一半的文件
+    # 指定 manifest 时按内容摘要(不含 volatile)决定是否替换, 内容未变化时不改写原文件; digest 为多个文件共用的 DigestWriter
+    tmp = f'{path}.tmp'
+    try:
+        with open(tmp, mode, **kwargs) as fp:
+            if manifest is not None and digest is None:
+                digest = DigestWriter(fp, volatile, encoding=kwargs.get('encoding') or 'utf-8')
+                yield digest
+            else:
+                yield fp
+        if manifest is None:
+            os.replace(tmp, path)
+        else:
+            manifest.commit(path, tmp, digest.hexdigest())
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
 def conv_bool(v):
     if isinstance(v, bool):
         return v
@@ -111,21 +393,139 @@ def clean_inline_comment(v):
         return l
     return '\n'.join([_remove_inline_comment(s) for s in v.strip().splitlines()])
 
+_retry_status = {408, 429, 500, 502, 503, 504}
+
+def is_transient_error(e):
+    # 连接错误、超时、传输中断及服务端临时错误可重试
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code in _retry_status
+    return isinstance(e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+def backoff_delay(attempt, base=DEF_RETRY_BACKOFF):
+    # 指数退避, 随机抖动避免同时重试
+    return random.uniform(0, base * 2 ** attempt)
+
 def is_ipv6(url):
     p = urlparse(url)
     return re.match(r'\[[0-9a-fA-F:]+\]', p.netloc) is not None
 
+# 频道名规范化规则, 预编译一次
+_re_jap_kor = re.compile(r'[\u3040-\u309F\u30A0-\u30FF\uAC00-\uD7A3]')  # \uAC00-\uD7A3为匹配韩文的，其余为日文
+_re_cctv_suffix = re.compile(r'-[(HD)0]*')                                  # CCTV-0 CCTV-HD
+_re_cctv = re.compile(r'(CCTV[1-9][0-9]?[\+K]?).*')
+_re_cetv_suffix = re.compile(r'[ -][(HD)0]*')
+_re_cetv = re.compile(r'(CETV[1-4]).*')
+_re_tvb = re.compile(r'^TVB[^s]', re.IGNORECASE)
+_re_trailing_word = re.compile(r'(.*) +.*')
+_name_prefixes = [(p, re.compile(fr'^{p}', re.IGNORECASE), re.compile(f'{p} +')) for p in ['NewTV', 'CHC', 'iHOT']]
+_re_any_prefix = re.compile('|'.join(f'^{p}' for p, _, _ in _name_prefixes), re.IGNORECASE)
+_zhconv_update = {'「': '「', '」': '」'}
+_re_uri_suffix = re.compile(r'\$.*$')
+
+class PlaylistExporter:
+    """
+    遍历一次频道数据, 同时写出多个输出, 输出的数量不影响遍历次数
+    每个输出为 (格式, 是否只含 IPv4 线路, 文件对象), 格式为 m3u/txt/jsonl
+    jsonl 每行一个频道: {"cate", "name", "lines": [线路, ...]}, 含供递补的线路, exported 表示是否导出到播放列表
+    attrs 为预先生成的 (分类, 频道) => m3u 属性(如 tvg-id/tvg-logo), header 为 m3u 文件头的属性(如 x-tvg-url)
+    """
+    FORMATS = ('m3u', 'txt', 'jsonl')
+
+    def __init__(self, outputs, attrs=None, header=''):
+        for fmt, _, _ in outputs:
+            if fmt not in self.FORMATS:
+                raise ValueError(f'不支持的导出格式: {fmt}')
+        self.outputs = outputs
+        self.attrs = attrs or {}
+        self.header = header
+
+    def _targets(self, fmt, ipv4_only):
+        return [fp for f, v4, fp in self.outputs if f == fmt and v4 == ipv4_only]
+
+    def write(self, channel_cates, channels, cates=None):
+        m3u, m3u_v4 = self._targets('m3u', False), self._targets('m3u', True)
+        txt, txt_v4 = self._targets('txt', False), self._targets('txt', True)
+        jsonl = self._targets('jsonl', False) + self._targets('jsonl', True)
+        full = [(fp, True) for fp in m3u] + [(fp, False) for fp in txt]
+        v4 = [(fp, True) for fp in m3u_v4] + [(fp, False) for fp in txt_v4]
+        for fp in m3u + m3u_v4:
+            fp.write(f'#EXTM3U {self.header}\n' if self.header else '#EXTM3U\n')
+
+        for cate, names in channel_cates.items():
+            if cates is not None and cate not in cates:
+                continue
+            for channel in names:
+                lines = channels.get(channel)
+                if lines is None:
+                    continue
+                m3u_head = f'#EXTINF:-1 {self.attrs.get((cate, channel), "")}group-title="{cate}",{channel}\n'
+                txt_head = f'{channel},'
+                limit = lines.limit
+                # 线路已按导出顺序排列, 全部线路及仅 IPv4 线路各取前 limit 条
+                full_left = limit if full or jsonl else 0
+                v4_left = limit if v4 else 0
+                exported = []
+                for line in lines:
+                    if full_left is None or full_left > 0:
+                        for fp, is_m3u in full:
+                            fp.write(f'{m3u_head}{line.uri}\n' if is_m3u else f'{txt_head}{line.uri}\n')
+                        if jsonl:
+                            exported.append(line)
+                        if full_left is not None:
+                            full_left -= 1
+                    if not line.ipv6 and (v4_left is None or v4_left > 0):
+                        for fp, is_m3u in v4:
+                            fp.write(f'{m3u_head}{line.uri}\n' if is_m3u else f'{txt_head}{line.uri}\n')
+                        if v4_left is not None:
+                            v4_left -= 1
+                    if not jsonl and full_left == 0 and v4_left == 0:
+                        break
+                if jsonl:
+                    self._write_json(jsonl, cate, channel, lines, {id(l) for l in exported})
+
+    @staticmethod
+    def _write_json(targets, cate, channel, lines, exported):
+        rows = []
+        for l in lines:
+            row = l.as_dict()
+            row['exported'] = id(l) in exported
+            if row['response_time'] == float('inf'):
+                row['response_time'] = None
+            rows.append(row)
+        data = json_dump({'cate': cate, 'name': channel, 'lines': rows}, indent=None)
+        for fp in targets:
+            fp.write(data)
+            fp.write('\n')
+
 class IPTV:
     def __init__(self, *args, **kwargs):
         self._cate_logos = None
+        self._channel_logos = None
+        self._export_attrs = None
         self._channel_map = None
         self._blacklist = None
         self._whitelist = None
+        self._http_cache = None
+        self._parsed_cache = None
+        self._name_normalizer = None
+        self._line_health = None
+        self._source_health = None
+        self._transport = None
+        self._transport_lock = threading.Lock()
+        self._seen_lines = None
+        self._source_stats = None
+        self._raw_writer = None
+
+        self._host_semaphores = {}
+        self._host_semaphores_lock = threading.Lock()
+        # 本次运行中按内容指纹共享的子进程解析任务
+        self._digest_futures = {}
+        self._digest_lock = threading.Lock()
 
         self.raw_config = None
-        self.raw_channels = {}
         self.channel_cates = OrderedDict()
         self.channels = {}
+        self.metrics = Metrics('iptv')
 
     def get_config(self, key, *convs, default=None):
         if not self.raw_config:
@@ -166,24 +566,177 @@ class IPTV:
             self._cate_logos = self.get_config('logo_cate', conv_dict, default={})
         return self._cate_logos
 
+    @property
+    def channel_logos(self):
+        if self._channel_logos is None:
+            self._channel_logos = self.get_config('logo_channel', conv_dict, default={})
+        return self._channel_logos
+
+    def get_channel_logo(self, name, cate, prefix):
+        # 优先使用频道单独设置的图标, 其次是分类的图标, 默认为 {频道名}.png; prefix 为 logo_url_prefix
+        if not prefix:
+            return None
+        filename = self.channel_logos.get(name) or self.cate_logos.get(cate) or f'{name}.png'
+        return f'{prefix.rstrip("/")}/{quote(filename)}'
+
+    def load_epg_channels(self):
+        """
+        从 dist 中已导出的 epg.xml(.gz) 读取 {频道名: EPG 频道 id}, 频道名已按 epg.txt 映射为规范频道名
+        频道元素在节目之前, 读到第一个节目即停止
+        """
+        for filename, opener in (('epg.xml.gz', gzip.open), ('epg.xml', open)):
+            path = self.get_dist(filename)
+            if not os.path.isfile(path):
+                continue
+            ids = {}
+            try:
+                with opener(path, 'rb') as fp:
+                    for _, elem in ET.iterparse(fp):
+                        if elem.tag == 'programme':
+                            break
+                        if elem.tag == 'channel':
+                            name = elem.findtext('display-name')
+                            if name and name not in ids:
+                                ids[name] = elem.get('id')
+            except (OSError, ET.ParseError, EOFError) as e:
+                logging.warning(f'读取 EPG 频道失败: {path} {e}')
+                continue
+            return ids
+        return {}
+
+    def link_epg(self, epg_channels=None):
+        """
+        预先生成每个导出频道的 tvg-id/tvg-name/tvg-logo 属性, 播放器无需再按频道名模糊匹配节目表
+        epg_channels 为 {频道名: EPG 频道 id}, 未指定时读取 dist 中已导出的 EPG; 返回属性是否有变化
+        """
+        if epg_channels is None:
+            epg_channels = self.load_epg_channels()
+        logo_prefix = self.get_config('logo_url_prefix', default='')
+        attrs = {}
+        unlinked = set()
+        for cate, channels in self.channel_cates.items():
+            for channel in channels:
+                parts = []
+                tvg_id = epg_channels.get(channel)
+                if tvg_id:
+                    parts.append(f'tvg-id="{tvg_id.replace(chr(34), chr(39))}"')
+                else:
+                    unlinked.add(channel)
+                parts.append(f'tvg-name="{channel}"')
+                logo = self.get_channel_logo(channel, cate, logo_prefix)
+                if logo:
+                    parts.append(f'tvg-logo="{logo}"')
+                attrs[(cate, channel)] = ' '.join(parts) + ' '
+        if epg_channels and unlinked:
+            logging.info(f'没有对应 EPG 频道的频道: {len(unlinked)}')
+        changed = attrs != self._export_attrs
+        self._export_attrs = attrs
+        return changed
+
+    @property
+    def export_attrs(self):
+        if self._export_attrs is None:
+            self.link_epg()
+        return self._export_attrs
+
+    @property
+    def export_header(self):
+        # tvg-id 取自本项目导出的 EPG(见 link_epg), epg 需指向同一份 EPG 的发布地址
+        epg = self.get_config('epg', default='')
+        return f'x-tvg-url="{epg}"' if epg else ''
+
     @property
     def channel_map(self):
         if self._channel_map is None:
             self._channel_map = self.get_config('channel_map', conv_dict, default={})
         return self._channel_map
 
+    def _load_url_matcher(self, key):
+        patterns = self.get_config(key, conv_list, default=[])
+        for f in self.get_config(f'{key}_files', conv_list, default=[]):
+            patterns.extend(load_pattern_file(f))
+        matcher = UrlMatcher(patterns)
+        logging.debug(f'名单 {key}: 主机 {len(matcher.hosts)} 正则 {len(matcher.patterns)}')
+        return matcher
+
     @property
     def blacklist(self):
         if self._blacklist is None:
-            self._blacklist = self.get_config('blacklist', conv_list, default=[])
+            self._blacklist = self._load_url_matcher('blacklist')
         return self._blacklist
 
     @property
     def whitelist(self):
         if self._whitelist is None:
-            self._whitelist = self.get_config('whitelist', conv_list, default=[])
+            self._whitelist = self._load_url_matcher('whitelist')
         return self._whitelist
 
+    @property
+    def http_cache(self):
+        if self._http_cache is None:
+            if self.get_config('cache', conv_bool, default=True):
+                self._http_cache = HTTPCache(
+                    IPTV_CACHE,
+                    max_size=self.get_config('cache_max_size', int, default=DEF_CACHE_MAX_SIZE // 1024 // 1024) * 1024 * 1024,
+                    max_age=self.get_config('cache_max_age', int, default=DEF_CACHE_MAX_AGE),
+                    stale_if_error=self.get_config('cache_stale_if_error', conv_bool, default=True))
+            else:
+                self._http_cache = False
+        return self._http_cache
+
+    def open_parsed_cache(self):
+        """
+        打开解析结果缓存, 未启用时返回 False; 需在启动获取线程前调用, 避免多个线程同时创建
+        """
+        if self._parsed_cache is None:
+            if self.get_config('dedup', conv_bool, default=True) and self.http_cache:
+                signature = hashlib.sha1(json.dumps(sorted(self.channel_map.items()), ensure_ascii=False).encode()).hexdigest()
+                self._parsed_cache = ParsedBatchCache(
+                    self._get_path(IPTV_CACHE, 'parsed'), signature,
+                    max_age=self.get_config('parsed_cache_max_age', int, default=DEF_PARSED_MAX_AGE // 86400) * 86400)
+            else:
+                self._parsed_cache = False
+        return self._parsed_cache
+
+    @property
+    def parsed_cache(self):
+        return self.open_parsed_cache()
+
+    @property
+    def line_health(self):
+        if self._line_health is None:
+            if self.get_config('health', conv_bool, default=True):
+                path = self._get_path(IPTV_CACHE, 'health.sqlite')
+                retention = self.get_config('health_retention', int, default=DEF_HEALTH_RETENTION // 86400) * 86400
+                self._line_health = LineHealthStore(path, retention=retention)
+            else:
+                self._line_health = False
+        return self._line_health
+
+    @property
+    def transport(self):
+        # 获取线程共用同一个传输层, 以便复用连接
+        with self._transport_lock:
+            if self._transport is None:
+                dns_cache.ttl = self.get_config('dns_ttl', int, default=DEF_DNS_TTL)
+                self._transport = Transport(
+                    self.get_config('user_agent', default=DEF_USER_AGENT),
+                    pool_size=max(1, self.get_config('fetch_per_host', int, default=DEF_FETCH_PER_HOST)),
+                    proxy=self.get_config('proxy'),
+                    source_proxies=self.get_config('source_proxy', conv_list, parse_source_options, default={}),
+                    source_user_agents=self.get_config('source_user_agent', conv_list, parse_source_options, default={}))
+            return self._transport
+
+    @property
+    def source_health(self):
+        if self._source_health is None:
+            if self.get_config('breaker', conv_bool, default=True):
+                self._source_health = SourceHealthStore(self._get_path(IPTV_CACHE, 'health.sqlite'))
+            else:
+                self._source_health = False
+        return self._source_health
+
+    @timed('load_channels')
     def load_channels(self):
         for f in IPTV_CHANNEL.split(','):
             current = ''
@@ -207,63 +760,375 @@ class IPTV:
                         else:
                             self.channel_cates[current].add(line)
 
-        for v in self.channel_cates.values():
+        limit = self.get_config('limit', int, default=DEF_LINE_LIMIT)
+        reserve = self.get_config('limit_reserve', int, default=DEF_LINE_RESERVE)
+        cate_limits = self.get_config('limit_cate', conv_dict, default={})
+        channel_limits = self.get_config('limit_channel', conv_dict, default={})
+        for cate, v in self.channel_cates.items():
             for c in v:
-                self.channels.setdefault(c, [])
-
-    def fetch(self, url):
-        headers = {'User-Agent': DEF_USER_AGENT}
+                if c in self.channels:
+                    continue
+                # 频道 > 分类 > 全局, 0 为不限制
+                l = channel_limits.get(c, cate_limits.get(cate, limit))
+                try:
+                    l = int(l)
+                except ValueError:
+                    logging.error(f'线路数量限制配置错误: {c} {l}')
+                    l = limit
+                self.channels[c] = ChannelLines(l, reserve)
+
+    def _fetch_once(self, url, headers, entry, timeout, with_fingerprint=False):
+        cache = self.http_cache
+        transport = self.transport
         start_time = time.time()
-        try:
-            res = requests.get(url, timeout=DEF_REQUEST_TIMEOUT, headers=headers)
-            res.raise_for_status()
+        with transport.get(url, headers, timeout) as res:
             response_time = time.time() - start_time
-            return res, response_time
-        except Exception as e:
-            logging.warning(f'获取失败: {url} {e}')
+            if res.status_code == 304 and entry is not None:
+                logging.debug(f'未修改, 使用缓存: {url}')
+                cache.touch(entry, response_time)
+                ret = entry.response()
+            else:
+                res.raise_for_status()
+                # 内容按块落盘, 解析时再按块读取
+                chunks = transport.iter_content(res, DEF_CHUNK_SIZE)
+                # 内容指纹在落盘的同时计算, 不需要整体读取内容
+                digest = Fingerprint() if with_fingerprint else None
+                if cache:
+                    ret = cache.store(url, res.headers, chunks, response_time, digest).response()
+                else:
+                    if digest is not None:
+                        chunks = digest.wrap(chunks)
+                    fp = tempfile.SpooledTemporaryFile(max_size=DEF_SPOOL_SIZE)
+                    try:
+                        for chunk in chunks:
+                            fp.write(chunk)
+                    except Exception:
+                        fp.close()
+                        raise
+                    ret = CachedResponse(url, fp, res.headers, res.status_code, from_cache=False,
+                                         fingerprint=digest.hexdigest() if digest is not None else None)
+            ret.timing = res.timing
+            return ret, response_time
+
+    def fetch(self, url, timeout=None, retries=None, with_fingerprint=False):
+        """
+        timeout 为 (连接超时, 读取超时), retries 为临时错误的重试次数, 重试的等待时间不计入响应时间
+        with_fingerprint 时在下载的同时计算内容指纹(见 playlist.Fingerprint)
+        """
+        headers = {}
+        cache = self.http_cache
+        entry = cache.get(url) if cache else None
+        if entry is not None:
+            if cache.is_fresh(entry):
+                logging.debug(f'使用缓存: {url}')
+                return entry.response(), entry.response_time
+            headers.update(entry.validators())
+
+        timeout = timeout or (self.get_config('fetch_connect_timeout', float, default=DEF_CONNECT_TIMEOUT), DEF_REQUEST_TIMEOUT)
+        if retries is None:
+            retries = self.get_config('fetch_retries', int, default=DEF_FETCH_RETRIES)
+        for attempt in range(retries + 1):
+            try:
+                return self._fetch_once(url, headers, entry, timeout, with_fingerprint)
+            except Exception as e:
+                error = e
+                if attempt < retries and is_transient_error(e):
+                    delay = backoff_delay(attempt)
+                    logging.debug(f'获取失败, {delay:.1f}s 后重试: {url} {e}')
+                    time.sleep(delay)
+                    continue
+                break
+        if entry is not None and cache.stale_if_error:
+            logging.warning(f'获取失败, 使用过期缓存: {url} {error}')
+            return entry.response(stale=True), entry.response_time
+        logging.warning(f'获取失败: {url} {error}')
+        return None, float('inf')
+
+    def fetch_stale(self, url):
+        # 熔断跳过的源, 允许时使用上次成功获取的缓存
+        cache = self.http_cache
+        entry = cache.get(url) if cache and cache.stale_if_error else None
+        if entry is None:
             return None, float('inf')
+        return entry.response(stale=True), entry.response_time
+
+    def source_timeout(self, health):
+        connect = self.get_config('fetch_connect_timeout', float, default=DEF_CONNECT_TIMEOUT)
+        if health is None or not health.response_times:
+            return connect, DEF_REQUEST_TIMEOUT
+        # 按最近几次的响应时间调整读取超时, 留出足够余量
+        read = max(health.response_times) * DEF_TIMEOUT_FACTOR
+        return connect, min(DEF_REQUEST_TIMEOUT, max(DEF_READ_TIMEOUT_MIN, read))
+
+    def fetch_source(self, url, with_fingerprint=False):
+        """
+        按源的历史记录获取: 正常的源按历史调整超时; 连续失败的源在冷却期内跳过, 冷却期后以短超时试探一次
+        返回 (响应, 响应时间, 熔断状态)
+        """
+        health = self.source_health.get(url) if self.source_health else None
+        state = BREAKER_CLOSED
+        if health is not None:
+            state = health.state(self.get_config('breaker_threshold', int, default=DEF_BREAKER_THRESHOLD),
+                                 self.get_config('breaker_cooldown', float, default=DEF_BREAKER_COOLDOWN // 3600) * 3600)
+        if state == BREAKER_OPEN:
+            logging.info(f'源连续失败 {health.fail_streak} 次, 跳过: {url}')
+            return (*self.fetch_stale(url), state)
+        if state == BREAKER_HALF_OPEN:
+            timeout = self.get_config('breaker_probe_timeout', float, default=DEF_BREAKER_PROBE_TIMEOUT)
+            logging.info(f'源连续失败 {health.fail_streak} 次, 试探: {url}')
+            return (*self.fetch_limited(url, (timeout, timeout), 0, with_fingerprint), state)
+        return (*self.fetch_limited(url, self.source_timeout(health), None, with_fingerprint), state)
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc
+        with self._host_semaphores_lock:
+            if host not in self._host_semaphores:
+                limit = self.get_config('fetch_per_host', int, default=DEF_FETCH_PER_HOST)
+                self._host_semaphores[host] = threading.BoundedSemaphore(max(1, limit))
+            return self._host_semaphores[host]
+
+    def fetch_limited(self, url, timeout=None, retries=None, with_fingerprint=False):
+        # 同一主机(如 gh.catmak.name 代理)的并发数受限, 等待时间不计入响应时间
+        with self._host_semaphore(url):
+            return self.fetch(url, timeout, retries, with_fingerprint)
+
+    def _interleave_by_host(self, urls):
+        # 按主机轮询排列提交顺序, 避免工作线程集中阻塞在同一主机的信号量上
+        groups = OrderedDict()
+        for index, url in enumerate(urls):
+            groups.setdefault(urlparse(url).netloc, []).append(index)
+        return [i for batch in itertools.zip_longest(*groups.values()) for i in batch if i is not None]
+
+    def iter_prepared(self, parser, stats):
+        """
+        逐条取出解析器中的条目并规范化, 跳过无效的条目; 规范化耗时按源累计后计入 normalize 阶段
+        """
+        prepare = self.prepare_channel_uri
+        perf_counter = time.perf_counter
+        normalize_time = 0.0
+        try:
+            for entry in parser:
+                stats.lines_parsed += 1
+                start_time = perf_counter()
+                prepared = prepare(entry.name, entry.uri)
+                normalize_time += perf_counter() - start_time
+                if prepared is not None:
+                    yield prepared
+        finally:
+            self.metrics.add_time('normalize', normalize_time)
+
+    def begin_source(self, url, res, response_time):
+        """
+        记录获取成功的源, 返回该源的统计
+        """
+        stats = self.metrics.source(url)
+        stats.ok = True
+        stats.from_cache = getattr(res, 'from_cache', False)
+        stats.response_time = response_time
+        stats.timing = getattr(res, 'timing', None)
+        return stats
+
+    def source_entries(self, res, stats, parsed=None, digest=None):
+        """
+        返回 (格式, 规范化后的条目生成器), 解析的字节数及条目数计入 stats; parsed 同 parse_source
+        子进程中的解析耗时预先计入 stats.parse_time, 其余从 0 开始, 由调用方累加合并耗时
+        不是缓存的解析结果且有内容指纹时, 在取出条目的同时按组写入解析结果缓存, 全部取完才完成写入, 中途关闭时丢弃
+        """
+        stats.parse_time = 0.0
+        if isinstance(parsed, CachedBatch):
+            stats.bytes, stats.lines_parsed = parsed.bytes, parsed.count
+            self.metrics.inc('parsed_cache_hits')
+            return parsed.format, iter(parsed)
+        if parsed is None:
+            parser = PlaylistParser(stats.count_bytes(res.iter_content(DEF_CHUNK_SIZE)))
+            fmt, entries = parser.format, self.iter_prepared(parser, stats)
+        else:
+            fmt, stats.bytes, stats.lines_parsed, entries, stats.parse_time, normalize_time = parsed
+            self.metrics.add_time('normalize', normalize_time)
+        return fmt, self._write_entries(entries, fmt, stats, digest)
 
+    def _write_entries(self, entries, fmt, stats, digest):
+        writer = self.parsed_cache.writer(digest) if digest is not None and self.parsed_cache else None
+        try:
+            for prepared in entries:
+                if writer is not None:
+                    writer.add(prepared)
+                yield prepared
+            if writer is not None:
+                writer.finish(fmt, stats.bytes, stats.lines_parsed)
+                writer = None
+        finally:
+            if writer is not None:
+                writer.abort()
+
+    def parse_source(self, url, res, response_time, parsed=None, digest=None):
+        """
+        解析并合并一个源; parsed 为缓存的解析结果(CachedBatch)或子进程中解析及规范化的结果(见 parse_payload), 此时只需按顺序合并
+        否则流式解析; 有内容指纹时在合并的同时按组写入解析结果缓存
+        返回本源中出现的频道线路 {(频道, 地址): 次数}, 未启用线路健康记录时返回 None
+        """
+        stats = self._source_stats = self.begin_source(url, res, response_time)
+        start_time = time.perf_counter()
+        fmt, entries = self.source_entries(res, stats, parsed, digest)
+        logging.info(f'获取成功: {fmt.upper()} {url}, 响应时间: {response_time:.2f}s')
+        if self._raw_writer is not None:
+            self._raw_writer.begin_source(url, response_time)
+        # 记录本源中出现的频道线路, 用于线路健康记录
+        self._seen_lines = seen_lines = Counter() if self.line_health else None
+        try:
+            for prepared in entries:
+                self.accept_channel_uri(*prepared, response_time, url)
+        finally:
+            entries.close()
+            res.close()
+            if self._seen_lines:
+                self.line_health.record_seen(url, self._seen_lines)
+            self._seen_lines = None
+            self._source_stats = None
+            stats.parse_time += time.perf_counter() - start_time
+            self.metrics.add_time('parse', stats.parse_time)
+        return seen_lines
+
+    def fetch_and_dispatch(self, url, pool=None):
+        """
+        返回 (响应, 响应时间, 熔断状态, 内容指纹, 解析结果)
+        启用去重时在下载的同时计算内容指纹, 有缓存的解析结果时直接返回; 否则较大的源下载完成后立即交给进程池解析(内容相同的源共用同一个任务),
+        其余的源在主线程中流式解析
+        """
+        dedup = self.get_config('dedup', conv_bool, default=True)
+        res, response_time, state = self.fetch_source(url, dedup)
+        if res is None:
+            return res, response_time, state, None, None
+        digest = None
+        if dedup:
+            # 旧版本写入的缓存没有指纹, 按块读取计算
+            digest = res.fingerprint or fingerprint(res.iter_content(DEF_CHUNK_SIZE))
+            batch = self.parsed_cache.get(digest) if self.parsed_cache else None
+            if batch is not None:
+                return res, response_time, state, digest, batch
+        if pool is None:
+            return res, response_time, state, digest, None
+        # 进程池解析需要整体传递内容, 只用于较大的源
+        content = res.content
+        if len(content) < self.get_config('parse_min_size', int, default=DEF_PARSE_MIN_SIZE // 1024) * 1024:
+            return res, response_time, state, digest, None
+        with self._digest_lock:
+            future = self._digest_futures.get(digest) if digest else None
+            if future is None:
+                future = pool.submit(parse_payload, content)
+                if digest:
+                    self._digest_futures[digest] = future
+        return res, response_time, state, digest, future
+
+    def parse_result(self, url, parsed):
+        """
+        取得子进程的解析结果, 失败时返回 None 交由 parse_source 流式解析
+        """
+        if not isinstance(parsed, Future):
+            return parsed
+        try:
+            return parsed.result()
+        except Exception as e:
+            logging.warning(f'子进程解析失败, 改为在主进程中解析: {url} {e}')
+            return None
+
+    def _parse_pool(self):
+        workers = self.get_config('parse_workers', int, default=DEF_PARSE_WORKERS)
+        if workers < 0:
+            workers = os.cpu_count() or 1
+        if not workers:
+            return None
+        # 下载线程已在运行, 使用 spawn 避免 fork 多线程进程
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_parse_worker, initargs=(IPTV_CONFIG,))
+
+    @contextmanager
+    def raw_export(self, filename='raw.jsonl'):
+        """
+        设置 EXPORT_RAW 时, 在此期间合并的全部线路流式写入 dist/raw.jsonl (见 RawLineWriter); 未设置时没有任何开销
+        """
+        if not EXPORT_RAW:
+            yield None
+            return
+        with atomic_write(self.get_dist(filename), 'w', encoding='utf-8') as fp:
+            self._raw_writer = RawLineWriter(fp)
+            try:
+                yield self._raw_writer
+            finally:
+                logging.info(f'原始线路已导出: {filename}, 线路: {self._raw_writer.count}')
+                self._raw_writer = None
+
+    @timed('fetch')
     def fetch_sources(self):
         sources = self.get_config('source', conv_list, default=[])
+        workers = self.get_config('fetch_workers', int, default=DEF_FETCH_WORKERS)
         success_count = 0
         failed_sources = []
-        for url in sources:
-            res, response_time = self.fetch(url)
-            if res is None:
-                failed_sources.append(url)
-                continue
-            is_m3u = any('#EXTINF' in l.decode() for l in islice(res.iter_lines(), 10))
-            logging.info(f'获取成功: {"M3U" if is_m3u else "TXT"} {url}, 响应时间: {response_time:.2f}s')
-            success_count = success_count + 1
-
-            cur_cate = None
-
-            for line in res.iter_lines():
-                line = line.decode().strip()
-                if not line:
-                    continue
-
-                if is_m3u:
-                    if line.startswith("#EXTINF"):
-                        match = re.search(r'group-title="(.*?)",(.*)', line)
-                        if match:
-                            cur_cate = match.group(1).strip()
-                            chl_name = match.group(2).strip()
-                    elif not line.startswith("#"):
-                        channel_url = line.strip()
-                        self.add_channel_uri(chl_name, channel_url, response_time)
-                else:
-                    if "#genre#" in line:
-                        cur_cate = line.split(",")[0].strip()
-                    elif cur_cate:
-                        match = re.match(r"^(.*?),(.*?)$", line)
-                        if match:
-                            chl_name = match.group(1).strip()
-                            channel_url = match.group(2).strip()
-                            self.add_channel_uri(chl_name, channel_url, response_time)
-        logging.info(f'源读取完毕: 成功: {success_count} 失败: {len(failed_sources)}')
+        skipped_sources = []
+        duplicate_sources = []
+        merged_digests = {}
+        if not sources:
+            logging.warning('未配置任何源')
+        # 在主线程中打开源记录及解析结果缓存, 获取线程只读取
+        source_health = self.source_health
+        parsed_cache = self.open_parsed_cache()
+
+        pool = self._parse_pool()
+        try:
+            with self.raw_export(), ThreadPoolExecutor(max_workers=max(1, min(workers, len(sources) or 1))) as executor:
+                futures = [None] * len(sources)
+                for index in self._interleave_by_host(sources):
+                    futures[index] = executor.submit(self.fetch_and_dispatch, sources[index], pool)
+
+                # 按配置顺序合并结果, 保证输出稳定且与是否并行解析无关; 后续源在合并期间继续下载及解析
+                for url, future in zip(sources, futures):
+                    res, response_time, state, digest, parsed = future.result()
+                    if state == BREAKER_OPEN:
+                        skipped_sources.append(url)
+                    elif source_health:
+                        ok = res is not None and not getattr(res, 'stale', False)
+                        source_health.record(url, ok, response_time if ok else None)
+                        if ok and state == BREAKER_HALF_OPEN:
+                            logging.info(f'源已恢复: {url}')
+                    if res is None:
+                        if state != BREAKER_OPEN:
+                            failed_sources.append(url)
+                        self.metrics.source(url).response_time = response_time
+                        continue
+                    success_count = success_count + 1
+                    if digest is not None and digest in merged_digests:
+                        # 转载或镜像的源: 重复合并只会重复计入线路的出现次数, 影响排序
+                        # 线路健康记录仍按源计入, 与内容相同的源出现的线路一致
+                        merged_url, seen_lines = merged_digests[digest]
+                        logging.info(f'内容与已合并的源相同, 跳过: {url} = {merged_url}')
+                        duplicate_sources.append(url)
+                        if seen_lines:
+                            self.line_health.record_seen(url, seen_lines)
+                        self.begin_source(url, res, response_time)
+                        res.close()
+                        continue
+                    seen_lines = self.parse_source(url, res, response_time, self.parse_result(url, parsed), digest)
+                    if digest is not None:
+                        merged_digests[digest] = (url, seen_lines)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            self._digest_futures.clear()
+        if parsed_cache:
+            parsed_cache.evict()
+
+        logging.info(f'源读取完毕: 成功: {success_count} 失败: {len(failed_sources)} 熔断跳过: {len(skipped_sources)}')
         if failed_sources:
             logging.warning(f'获取失败的源: {failed_sources}')
+        if skipped_sources:
+            logging.warning(f'熔断跳过的源: {skipped_sources}')
+        if duplicate_sources:
+            logging.info(f'内容重复的源: {duplicate_sources}')
+        self.metrics.set('sources_ok', success_count)
+        self.metrics.set('sources_failed', len(failed_sources))
+        self.metrics.set('sources_skipped', len(skipped_sources))
+        self.metrics.set('sources_duplicate', len(duplicate_sources))
+        self.stat_normalize_cache()
         self.stat_fetched_channels()
 
     def is_port_necessary(self, scheme, netloc):
@@ -285,67 +1150,63 @@ class IPTV:
         return False
 
     def clean_channel_name(self, name):
-        def re_subs(s, *reps):
-            for rep in reps:
-                r = ''
-                c = 0
-                if len(rep) == 1:
-                    p = rep[0]
-                elif len(rep) == 2:
-                    p, r = rep
-                else:
-                    p, r, c = rep
-                s = re.sub(p, r, s, c)
-            return s
-        def any_startswith(s, *args):
-            return any([re.search(fr'^{r}', s, re.IGNORECASE) for r in args])
-
-        def any_in(s, *args):
-            return any(a in s for a in args)
-
         # 繁 => 简
-        jap = re.compile(r'[\u3040-\u309F\u30A0-\u30FF\uAC00-\uD7A3]')  # \uAC00-\uD7A3为匹配韩文的，其余为日文
-        if not jap.search(name):
-            name = zhconv.convert(name, 'zh-cn', {'「': '「', '」': '」'})
+        if not _re_jap_kor.search(name):
+            name = zhconv.convert(name, 'zh-cn', _zhconv_update)
 
         if name.startswith('CCTV'):
-            name = re_subs(name,
-                                (r'-[(HD)0]*', ),                           # CCTV-0 CCTV-HD
-                                (r'(CCTV[1-9][0-9]?[\+K]?).*', r'\1')
-            )
+            name = _re_cctv_suffix.sub('', name)
+            name = _re_cctv.sub(r'\1', name)
             # FIX:
             # CCTV4美洲 ... => CCTV4
         elif name.startswith('CETV'):
-            name = re_subs(name,
-                                (r'[ -][(HD)0]*', ),
-                                (r'(CETV[1-4]).*', r'\1'),
-            )
-        elif any_startswith(name, 'NewTV', 'CHC', 'iHOT'):
-            for p in ['NewTV', 'CHC', 'iHOT']:
-                name = re.sub(fr'^{p}', p, name, 1, re.IGNORECASE)
+            name = _re_cetv_suffix.sub('', name)
+            name = _re_cetv.sub(r'\1', name)
+        elif _re_any_prefix.match(name):
+            for p, re_prefix, re_spaces in _name_prefixes:
+                name = re_prefix.sub(p, name, 1)
                 if not name.startswith(p):
                     continue
-                name = re_subs(name,
-                                    (re.compile(f'{p} +'), p, 1),
-                                    (r'(.*) +.*', r'\1')
-                )
-        elif re.match(r'^TVB[^s]', name, re.IGNORECASE):
+                name = re_spaces.sub(p, name, 1)
+                name = _re_trailing_word.sub(r'\1', name)
+        elif _re_tvb.match(name):
             name = name.replace(' ', '')
         return name
 
-    def add_channel_for_debug(self, name, url, org_name, org_url, response_time):
-        if name not in self.raw_channels:
-            self.raw_channels.setdefault(name, OrderedDict(source_names=set(), source_urls=set(), lines=[]))
+    def _normalize_channel_name(self, name):
+        """
+        原始频道名 => (映射后的原始名, 规范频道名)
+        """
+        name = self.try_map_channel_name(name)
+
+        # 处理频道名
+        org_name = name
+        name = self.clean_channel_name(name)
+        if org_name != name:
+            logging.debug(f'规范频道名: {org_name} => {name}')
 
-        self.raw_channels[name]['source_names'].add(org_name)
-        self.raw_channels[name]['source_urls'].add(org_url)
+        return org_name, self.try_map_channel_name(name)
 
-        for u in self.raw_channels[name]['lines']:
-            if u['uri'] == url:
-                u['count'] += 1
-                u['response_time'] = min(u['response_time'], response_time)
-                return
-        self.raw_channels[name]['lines'].append({'uri': url, 'count': 1, 'ipv6': is_ipv6(url), 'response_time': response_time})
+    @property
+    def name_normalizer(self):
+        # 同一频道名在各个源中反复出现, 按原始名缓存整个规范化结果
+        if self._name_normalizer is None:
+            size = self.get_config('name_cache_size', int, default=DEF_NAME_CACHE_SIZE)
+            self._name_normalizer = lru_cache(maxsize=size)(self._normalize_channel_name)
+        return self._name_normalizer
+
+    def normalize_channel_name(self, name):
+        return self.name_normalizer(name)
+
+    def stat_normalize_cache(self):
+        if self._name_normalizer is None:
+            return
+        info = self._name_normalizer.cache_info()
+        total = info.hits + info.misses
+        ratio = info.hits / total * 100 if total else 0
+        logging.info(f'频道名规范化缓存: 命中: {info.hits} 未命中: {info.misses} 命中率: {ratio:.1f}% 条目: {info.currsize}/{info.maxsize}')
+        self.metrics.set('name_cache_hits', info.hits)
+        self.metrics.set('name_cache_misses', info.misses)
 
     def try_map_channel_name(self, name):
         if name in self.channel_map.keys():
@@ -354,18 +1215,13 @@ class IPTV:
             logging.debug(f'映射频道名: {o_name} => {name}')
         return name
 
-    def add_channel_uri(self, name, uri, response_time):
-        uri = re.sub(r'\$.*$', '', uri)
-
-        name = self.try_map_channel_name(name)
-
-        # 处理频道名
-        org_name = name
-        name = self.clean_channel_name(name)
-        if org_name != name:
-            logging.debug(f'规范频道名: {org_name} => {name}')
-
-        name = self.try_map_channel_name(name)
+    def prepare_channel_uri(self, name, uri):
+        """
+        规范化频道名及地址, 只依赖配置, 可在子进程中执行
+        返回 (映射后的原始名, 规范频道名, 地址, 原始地址, 主机, 是否 IPv6), 地址有误时返回 None
+        """
+        uri = _re_uri_suffix.sub('', uri)
+        org_name, name = self.normalize_channel_name(name)
 
         changed = False
         p = urlparse(uri)
@@ -375,72 +1231,265 @@ class IPTV:
                 p = p._replace(netloc=p.netloc.rsplit(':', 1)[0])
         except Exception as e:
             logging.debug(f'频道线路地址出错: {name} {uri} {e}')
-            return
+            return None
 
         url = p.geturl() if changed else uri
-
-        self.add_channel_for_debug(name, url, org_name, uri, response_time)
-
-        if name not in self.channels:
-            return
-
-        if self.is_on_blacklist(url):
-            logging.debug(f'黑名单忽略: {name} {uri}')
+        return org_name, name, url, uri, p.netloc, p.netloc.startswith('[')
+
+    def add_channel_uri(self, name, uri, response_time, source=None):
+        prepared = self.prepare_channel_uri(name, uri)
+        if prepared is not None:
+            self.accept_channel_uri(*prepared, response_time, source)
+
+    def accept_channel_uri(self, org_name, name, url, uri, netloc, ipv6, response_time, source=None):
+        # source 为提供该线路的源地址, 用于统计各源独有的线路
+        result = self.check_channel_uri(name, url, netloc, self._source_stats)
+        raw = self._raw_writer
+        if raw is not None:
+            raw.write(org_name, name, url, result)
+        if result is not RawLineWriter.ACCEPTED:
+            if result is RawLineWriter.BLACKLISTED:
+                logging.debug(f'黑名单忽略: {name} {uri}')
             return
 
-        priority = DEF_WHITELIST_PRIORITY if self.is_on_whitelist(url) else 0
-        for u in self.channels[name]:
-            if u['uri'] == url:
-                u['count'] = u['count'] + 1
-                u['priority'] = u['count'] + priority
-                u['response_time'] = min(u['response_time'], response_time)
-                return
-        self.channels[name].append({'uri': url, 'priority': priority + 1, 'count': 1, 'response_time': response_time})
+        if self._seen_lines is not None:
+            self._seen_lines[(name, url)] += 1
 
-    def is_on_blacklist(self, url):
-        return any(re.search(pattern, url) for pattern in self.blacklist)
+        priority = DEF_WHITELIST_PRIORITY if self.is_on_whitelist(url, netloc) else 0
+        self.channels[name].add(url, priority, response_time, ipv6, source)
 
-    def is_on_whitelist(self, url):
-        return any(re.search(pattern, url) for pattern in self.whitelist)
+    def check_channel_uri(self, name, url, netloc, stats=None):
+        """
+        判断线路是否需要合并, 返回 RawLineWriter.ACCEPTED/UNWANTED/BLACKLISTED, 并计入 stats
+        """
+        if name not in self.channels:
+            if stats is not None:
+                stats.lines_unwanted += 1
+            return RawLineWriter.UNWANTED
+        if self.is_on_blacklist(url, netloc):
+            if stats is not None:
+                stats.lines_blacklisted += 1
+            return RawLineWriter.BLACKLISTED
+        if stats is not None:
+            self.metrics.record_line(stats, name)
+        return RawLineWriter.ACCEPTED
+
+    def is_on_blacklist(self, url, netloc=None):
+        return self.blacklist.match(url, netloc)
+
+    def is_on_whitelist(self, url, netloc=None):
+        return self.whitelist.match(url, netloc)
+
+    def line_sources(self):
+        # 保留的各线路的来源, 用于统计各源独有的线路(见 Metrics.finish)
+        return (l.source for lines in self.channels.values() for l in lines)
 
     def stat_fetched_channels(self):
         total_channels = len(self.channels)
         total_lines = sum(len(lines) for lines in self.channels.values())
         logging.info(f'获取到的频道数量: {total_channels}, 线路数量: {total_lines}')
+        self.metrics.set('channels', total_channels)
+        self.metrics.set('lines', total_lines)
+
+    @timed('probe')
+    def probe_channels(self, names=None):
+        """
+        names 为只探测的频道, 默认为全部频道
+        """
+        probe = self.get_config('probe', conv_bool, default=False)
+        health = self.line_health
+        if not probe and not health:
+            return
 
-    def sort_channels_by_response_time(self):
-        for channel, lines in self.channels.items():
-            self.channels[channel] = sorted(lines, key=lambda x: x['response_time'])
+        # 有健康记录时: 最近探测过的可用线路直接复用结果, 长期不可用的线路直接跳过, 只探测新的或过期的线路
+        stale = self.get_config('health_stale', int, default=DEF_HEALTH_STALE // 3600) * 3600
+        dead_streak = self.get_config('health_dead_streak', int, default=DEF_HEALTH_DEAD_STREAK)
+        dead_retry = self.get_config('health_dead_retry', int, default=DEF_HEALTH_DEAD_RETRY // 86400) * 86400
+        now = time.time()
+        uris = OrderedSet()
+        skipped_count = 0
+        reused_count = 0
+        for channel, lines in self._iter_channels(names):
+            for line in list(lines):
+                h = health.get(channel, line.uri) if health else None
+                if h is not None and probe and h.is_dead(dead_streak, dead_retry, now):
+                    skipped_count += 1
+                    logging.debug(f'线路长期不可用, 跳过: {channel} {line.uri}')
+                    lines.remove(line.uri)
+                elif h is not None and h.is_fresh(stale, now):
+                    reused_count += 1
+                    line.latency = h.latency
+                    line.throughput = h.throughput
+                elif probe:
+                    uris.add(line.uri)
+        if health:
+            logging.info(f'线路健康记录: 复用: {reused_count} 跳过: {skipped_count}')
+        if not uris:
+            return
 
+        prober = StreamProber(timeout=self.get_config('probe_timeout', float, default=DEF_PROBE_TIMEOUT),
+                              workers=self.get_config('probe_workers', int, default=DEF_PROBE_WORKERS),
+                              user_agent=self.transport.user_agent)
+        start_time = time.time()
+        results = prober.probe_all(uris)
+
+        dead_count = 0
+        probed = []
+        for channel, lines in self._iter_channels(names):
+            for line in list(lines):
+                result = results.get(line.uri)
+                if result is None:
+                    continue
+                if result.alive is not None:
+                    probed.append((channel, line.uri, result.alive, result.latency, result.throughput))
+                if result.alive is False:
+                    dead_count += 1
+                    logging.debug(f'线路不可用: {channel} {line.uri} {result.error}')
+                    lines.remove(line.uri)
+                    continue
+                line.latency = result.latency
+                line.throughput = result.throughput
+        logging.info(f'线路探测完毕: 探测: {len(uris)} 不可用: {dead_count}, 耗时: {time.time() - start_time:.2f}s')
+        if health:
+            health.record_probes(probed)
+
+    def _iter_channels(self, names=None):
+        if names is None:
+            return self.channels.items()
+        return [(n, self.channels[n]) for n in names if n in self.channels]
+
+    @timed('sort')
+    def sort_channels_by_response_time(self, names=None):
+        # 有探测结果时按实测延迟/吞吐量排序, 未探测的线路排在其后并按源响应时间排序
+        def _key(line):
+            latency = line.latency
+            return (latency is None,
+                    latency if latency is not None else line.response_time,
+                    -(line.throughput or 0),
+                    line.response_time,
+                    -line.priority)
+        for _, lines in self._iter_channels(names):
+            lines.sort(_key)
+
+    def render(self, outputs, cates=None):
+        """
+        outputs 为 [(格式, 是否只含 IPv4 线路, 文件对象)], 遍历一次同时写出, cates 为只导出的分类
+        """
+        PlaylistExporter(outputs, self.export_attrs, self.export_header).write(self.channel_cates, self.channels, cates)
+
+    def render_m3u(self, f, cates=None, ipv4_only=False):
+        self.render([('m3u', ipv4_only, f)], cates)
+
+    def render_txt(self, f, cates=None, ipv4_only=False):
+        self.render([('txt', ipv4_only, f)], cates)
+
+    def load_manifest(self, prefix=''):
+        """
+        dist 中的 {prefix}manifest.json, 未启用 manifest 时返回 None
+        """
+        if not self.get_config('manifest', conv_bool, default=True):
+            return None
+        return Manifest(self.get_dist(f'{prefix}manifest.json'))
+
+    @timed('export')
+    def export(self, name='live'):
+        """
+        遍历一次频道数据, 写出 {name}.m3u/{name}.txt, 设置 export_ipv4_version 时的 -ipv4 版本,
+        及设置 EXPORT_JSON 时的 channels.jsonl; 全部先写入临时文件, 内容有变化时再替换
+        返回有变化的文件, 未启用 manifest 时为 None
+        """
+        formats = [('m3u', False), ('txt', False)]
+        if self.get_config('export_ipv4_version', conv_bool, default=False):
+            formats += [('m3u', True), ('txt', True)]
+        manifest = self.load_manifest()
+        with ExitStack() as stack:
+            outputs = []
+            for fmt, ipv4_only in formats:
+                path = self.get_dist(f'{name}.{fmt}', ipv4_only)
+                outputs.append((fmt, ipv4_only, stack.enter_context(
+                    atomic_write(path, 'w', manifest, encoding='utf-8', buffering=DEF_EXPORT_BUFFER))))
+            if EXPORT_JSON:
+                outputs.append(('jsonl', False, stack.enter_context(
+                    atomic_write(self.get_dist('channels.jsonl'), 'w', manifest, encoding='utf-8', buffering=DEF_EXPORT_BUFFER))))
+            self.render(outputs)
+        if manifest is None:
+            return None
+        manifest.save()
+        return manifest.changed
+
+    @timed('export')
     def export_m3u(self, filename, ipv4_suffix=False):
-        path = self.get_dist(filename, ipv4_suffix)
-        with open(path, 'w', encoding='utf-8') as f:
-            f.write('#EXTM3U\n')
-            for cate, channels in self.channel_cates.items():
-                for channel in channels:
-                    if channel in self.channels:
-                        lines = self.channels[channel]
-                        for line in lines:
-                            f.write(f'#EXTINF:-1 group-title="{cate}",{channel}\n')
-                            f.write(f'{line["uri"]}\n')
+        with atomic_write(self.get_dist(filename, ipv4_suffix), 'w', encoding='utf-8', buffering=DEF_EXPORT_BUFFER) as f:
+            self.render_m3u(f, ipv4_only=ipv4_suffix)
 
+    @timed('export')
     def export_txt(self, filename, ipv4_suffix=False):
-        path = self.get_dist(filename, ipv4_suffix)
-        with open(path, 'w', encoding='utf-8') as f:
-            for cate, channels in self.channel_cates.items():
-                for channel in channels:
-                    if channel in self.channels:
-                        lines = self.channels[channel]
-                        for line in lines:
-                            f.write(f'{channel},{line["uri"]}\n')
+        with atomic_write(self.get_dist(filename, ipv4_suffix), 'w', encoding='utf-8', buffering=DEF_EXPORT_BUFFER) as f:
+            self.render_txt(f, ipv4_only=ipv4_suffix)
+
+    def export_metrics(self, metrics=None, prefix=''):
+        # 运行指标: metrics.json 及 Prometheus 文本格式的 metrics.prom
+        if not self.get_config('metrics', conv_bool, default=True):
+            return
+        metrics = metrics or self.metrics
+        metrics.finish(self.line_sources() if metrics is self.metrics else ())
+        with atomic_write(self.get_dist(f'{prefix}metrics.json'), 'w', encoding='utf-8') as fp:
+            json_dump(metrics.as_dict(), fp)
+        with atomic_write(self.get_dist(f'{prefix}metrics.prom'), 'w', encoding='utf-8') as fp:
+            fp.write(metrics.to_prometheus())
+        stages = ' '.join(f'{k}: {v:.2f}s' for k, v in metrics.stages.items())
+        logging.info(f'各阶段耗时: {stages}')
+
+
+_worker_iptv = None
+
+def init_parse_worker(config):
+    # 子进程使用与主进程相同的配置
+    global _worker_iptv, IPTV_CONFIG
+    IPTV_CONFIG = config
+    _worker_iptv = IPTV()
+
+def prepare_entries(iptv, chunks):
+    """
+    解析一个源并规范化频道名及地址, 返回 (格式, 解析出的条目数, [(映射后的原始名, 规范频道名, 地址, 原始地址, 主机, 是否 IPv6)])
+    """
+    parser = PlaylistParser(chunks)
+    prepare = iptv.prepare_channel_uri
+    perf_counter = time.perf_counter
+    count = 0
+    entries = []
+    normalize_time = 0.0
+    for entry in parser:
+        count += 1
+        start_time = perf_counter()
+        prepared = prepare(entry.name, entry.uri)
+        normalize_time += perf_counter() - start_time
+        if prepared is not None:
+            entries.append(prepared)
+    iptv.metrics.add_time('normalize', normalize_time)
+    return parser.format, count, entries
+
+def parse_payload(content, iptv=None):
+    """
+    在子进程中解析一个源, 返回紧凑的结果供主进程按顺序合并:
+    (格式, 字节数, 解析出的条目数, 规范化后的条目, 耗时, 规范化耗时)
+    """
+    iptv = iptv or _worker_iptv
+    start_time = time.perf_counter()
+    normalize_time = iptv.metrics.stages.get('normalize', 0.0)
+    fmt, count, entries = prepare_entries(
+        iptv, (content[i:i + DEF_CHUNK_SIZE] for i in range(0, len(content), DEF_CHUNK_SIZE)))
+    return (fmt, len(content), count, entries, time.perf_counter() - start_time,
+            iptv.metrics.stages.get('normalize', 0.0) - normalize_time)
 
 
 if __name__ == "__main__":
     iptv = IPTV()
     iptv.load_channels()
     iptv.fetch_sources()
+    iptv.probe_channels()
     iptv.sort_channels_by_response_time()
-    iptv.export_m3u('live.m3u')
-    iptv.export_txt('live.txt')
+    iptv.export()
+    iptv.export_metrics()
 
     
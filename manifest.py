@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+
+
+class DigestWriter:
+    """
+    写入的同时计算内容摘要, fp 为 None 时只计算摘要
+    volatile 为需要从摘要中排除的易变内容(如生成时间), 只排除第一次出现, 调用方需保证其不会被拆分到两次写入中
+    """
+    def __init__(self, fp=None, volatile=None, encoding='utf-8'):
+        self.fp = fp
+        self.encoding = encoding
+        self._volatile = volatile
+        self._hash = hashlib.sha1()
+
+    def write(self, data):
+        if self.fp is not None:
+            self.fp.write(data)
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        if self._volatile is not None and self._volatile in data:
+            data = data.replace(self._volatile, b'', 1)
+            self._volatile = None
+        self._hash.update(data)
+        return len(data)
+
+    def flush(self):
+        if self.fp is not None:
+            self.fp.flush()
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+class Manifest:
+    """
+    dist 输出的清单: 记录各文件内容(不含易变信息)的摘要, 内容未变化的文件不再改写, 减少磁盘写入、git 提交及客户端重复下载
+    changed 为本次运行中有变化的文件
+    """
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(path)
+        self.files = {}
+        self.changed = []
+        self.unchanged = []
+        try:
+            with open(path, encoding='utf-8') as fp:
+                self.files = json.load(fp).get('files', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f'读取清单失败: {path} {e}')
+
+    def commit(self, path, tmp, digest):
+        """
+        内容有变化(或文件不存在)时以临时文件替换 path, 否则丢弃临时文件; 返回是否有变化
+        """
+        name = os.path.relpath(path, self.root).replace(os.sep, '/')
+        if os.path.exists(path) and self.files.get(name, {}).get('digest') == digest:
+            os.remove(tmp)
+            self.unchanged.append(name)
+            return False
+        os.replace(tmp, path)
+        self.files[name] = {'digest': digest, 'size': os.path.getsize(path), 'updated_at': int(time.time())}
+        self.changed.append(name)
+        return True
+
+    def remove(self, path):
+        """
+        删除不再生成的文件
+        """
+        name = os.path.relpath(path, self.root).replace(os.sep, '/')
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        if self.files.pop(name, None) is not None:
+            self.changed.append(name)
+
+    def save(self):
+        if self.unchanged:
+            logging.info(f'内容未变化, 未改写: {len(self.unchanged)} 个文件')
+        if self.changed:
+            logging.info(f'内容有变化: {self.changed if len(self.changed) <= 10 else f"{len(self.changed)} 个文件"}')
+        data = {'updated_at': int(time.time()), 'changed': self.changed, 'files': self.files}
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fp:
+            json.dump(data, fp, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+
+if __name__ == '__main__':
+    # 供工作流判断是否需要提交: 最近一次运行有文件变化时返回 0
+    try:
+        with open(sys.argv[1], encoding='utf-8') as fp:
+            changed = json.load(fp).get('changed')
+    except (IndexError, OSError, ValueError):
+        changed = True
+    sys.exit(0 if changed else 1)
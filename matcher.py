@@ -0,0 +1,99 @@
+import re
+import logging
+from urllib.parse import urlparse
+
+# 仅由完整的主机名(以字母顶级域名结尾)或完整的 IPv4/IPv6 地址(及端口)组成的条目走哈希索引, 其余按正则处理
+# 不完整的条目(如 58.19.38)仍按正则在整个地址中搜索
+_octet = r'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+_re_plain_host = re.compile(
+    r'(?:(?:[A-Za-z0-9](?:[A-Za-z0-9-]*[A-Za-z0-9])?\.)+(?:[A-Za-z]{2,63}|xn--[A-Za-z0-9-]+)'
+    rf'|(?:{_octet}\.){{3}}{_octet}'
+    r'|\[[0-9a-fA-F:.]+\])(?::\d+)?')
+
+
+def load_pattern_file(path):
+    """
+    读取外部黑白名单文件, 每行一条, 支持 # 注释
+    """
+    patterns = []
+    try:
+        with open(path, encoding='utf-8') as fp:
+            for line in fp:
+                line = re.split(r' +#', line.strip())[0].strip()
+                if line and not line.startswith('#'):
+                    patterns.append(line)
+    except OSError as e:
+        logging.error(f'读取名单文件出错: {path} {e}')
+    return patterns
+
+
+def iter_host_keys(netloc):
+    """
+    依次返回 host:port、host 以及各级上级域名, 用于在主机索引中查找
+    """
+    netloc = netloc.rpartition('@')[2].lower()
+    yield netloc
+    host = netloc
+    if not netloc.endswith(']') and ':' in netloc:
+        host = netloc.rsplit(':', 1)[0]
+        yield host
+    if host.endswith(']') or host[-1:].isdigit():
+        return
+    while '.' in host:
+        host = host.split('.', 1)[1]
+        if '.' in host:
+            yield host
+
+
+class UrlMatcher:
+    """
+    黑白名单匹配器
+    纯主机名/IP/主机:端口 条目匹配地址的主机(含子域名), 查找为 O(1)
+    其它条目视为正则, 合并为一个表达式对整个地址做一次搜索
+    """
+    def __init__(self, patterns=None):
+        self.hosts = set()
+        self.patterns = []
+        self._regex = None
+        self._regexes = []
+        for p in patterns or []:
+            self.add(p)
+        self.compile()
+
+    def add(self, pattern):
+        pattern = pattern.strip()
+        if not pattern:
+            return
+        if _re_plain_host.fullmatch(pattern):
+            self.hosts.add(pattern.lower())
+            return
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            logging.error(f'名单正则错误, 已忽略: {pattern} {e}')
+            return
+        self.patterns.append(pattern)
+
+    def compile(self):
+        self._regex = None
+        self._regexes = []
+        if not self.patterns:
+            return
+        try:
+            self._regex = re.compile('|'.join(f'(?:{p})' for p in self.patterns))
+        except re.error:
+            # 含反向引用等无法合并的正则时逐条匹配
+            self._regexes = [re.compile(p) for p in self.patterns]
+
+    def __len__(self):
+        return len(self.hosts) + len(self.patterns)
+
+    def match(self, url, netloc=None):
+        if self.hosts:
+            if netloc is None:
+                netloc = urlparse(url).netloc
+            if netloc and any(k in self.hosts for k in iter_host_keys(netloc)):
+                return True
+        if self._regex is not None:
+            return self._regex.search(url) is not None
+        return any(r.search(url) for r in self._regexes)
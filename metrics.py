@@ -0,0 +1,166 @@
+import time
+import logging
+import functools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class SourceStats:
+    __slots__ = ('url', 'ok', 'from_cache', 'response_time', 'parse_time', 'bytes', 'lines_parsed',
+                 'lines_accepted', 'lines_blacklisted', 'lines_unwanted', 'channels', 'unique_lines', 'timing')
+
+    def __init__(self, url):
+        self.url = url
+        self.ok = False
+        self.from_cache = False
+        self.response_time = None
+        self.parse_time = 0.0
+        self.bytes = 0
+        self.lines_parsed = 0
+        self.lines_accepted = 0
+        self.lines_blacklisted = 0
+        self.lines_unwanted = 0
+        self.channels = set()
+        self.unique_lines = 0
+        self.timing = None
+
+    def count_bytes(self, chunks):
+        for chunk in chunks:
+            self.bytes += len(chunk)
+            yield chunk
+
+    def as_dict(self):
+        return {
+            'url': self.url,
+            'ok': self.ok,
+            'from_cache': self.from_cache,
+            'response_time': self.response_time if self.response_time != float('inf') else None,
+            'parse_time': round(self.parse_time, 6),
+            'bytes': self.bytes,
+            'lines_parsed': self.lines_parsed,
+            'lines_accepted': self.lines_accepted,
+            'lines_blacklisted': self.lines_blacklisted,
+            'lines_unwanted': self.lines_unwanted,
+            'channels': len(self.channels),
+            'unique_lines': self.unique_lines,
+            'timing': self.timing.as_dict() if self.timing is not None else None,
+        }
+
+
+def _escape_label(v):
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """
+    运行指标: 各阶段耗时(同名阶段累加)、各源的数据量及贡献, 可导出为 JSON 或 Prometheus 文本格式
+    """
+    def __init__(self, job):
+        self.job = job
+        self.started_at = time.time()
+        self.stages = OrderedDict()
+        self.sources = OrderedDict()
+        self.values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def inc(self, name, value=1):
+        self.values[name] = self.values.get(name, 0) + value
+
+    def source(self, url):
+        with self._lock:
+            if url not in self.sources:
+                self.sources[url] = SourceStats(url)
+            return self.sources[url]
+
+    def record_line(self, stats, channel):
+        stats.lines_accepted += 1
+        stats.channels.add(channel)
+
+    def finish(self, owners=()):
+        """
+        统计各源独有的线路数量, owners 为最终保留的各线路的来源(源地址, 多个源都提供时为 None)
+        只统计保留的线路, 不随合并过程中出现的线路总数增长; 没有独有线路的源可考虑移除
+        """
+        for stats in self.sources.values():
+            stats.unique_lines = 0
+        counted = False
+        for url in owners:
+            counted = True
+            stats = self.sources.get(url) if url is not None else None
+            if stats is not None:
+                stats.unique_lines += 1
+        useless = [s.url for s in self.sources.values() if s.ok and not s.unique_lines]
+        if counted and useless:
+            logging.info(f'没有独有线路的源: {useless}')
+
+    def as_dict(self):
+        return {
+            'job': self.job,
+            'started_at': self.started_at,
+            'stages': {k: round(v, 6) for k, v in self.stages.items()},
+            'values': dict(self.values),
+            'sources': [s.as_dict() for s in self.sources.values()],
+        }
+
+    def to_prometheus(self):
+        prefix = self.job
+        out = [f'# HELP {prefix}_stage_seconds 各阶段耗时(秒)',
+               f'# TYPE {prefix}_stage_seconds gauge']
+        for k, v in self.stages.items():
+            out.append(f'{prefix}_stage_seconds{{stage="{_escape_label(k)}"}} {v:.6f}')
+        for k, v in self.values.items():
+            out.append(f'# TYPE {prefix}_{k} gauge')
+            out.append(f'{prefix}_{k} {v}')
+        if self.sources:
+            rows = [s.as_dict() for s in self.sources.values()]
+            for field in ('ok', 'from_cache', 'response_time', 'parse_time', 'bytes', 'lines_parsed', 'lines_accepted',
+                          'lines_blacklisted', 'lines_unwanted', 'channels', 'unique_lines'):
+                name = f'{prefix}_source_{field}'
+                out.append(f'# TYPE {name} gauge')
+                for row in rows:
+                    value = row[field]
+                    if value is None:
+                        continue
+                    if isinstance(value, bool):
+                        value = int(value)
+                    out.append(f'{name}{{source="{_escape_label(row["url"])}"}} {value}')
+            name = f'{prefix}_source_timing_seconds'
+            out.append(f'# HELP {name} 请求耗时分解(秒)')
+            out.append(f'# TYPE {name} gauge')
+            for row in rows:
+                for phase, value in (row['timing'] or {}).items():
+                    if phase == 'reused':
+                        continue
+                    out.append(f'{name}{{source="{_escape_label(row["url"])}",phase="{phase}"}} {value}')
+        out.append(f'# TYPE {prefix}_last_run_timestamp_seconds gauge')
+        out.append(f'{prefix}_last_run_timestamp_seconds {self.started_at:.0f}')
+        return '\n'.join(out) + '\n'
+
+
+def timed(stage):
+    """
+    方法装饰器, 将耗时计入 self.metrics 的指定阶段
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(stage):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,168 @@
+import re
+import hashlib
+import typing as t
+
+DEF_CHUNK_SIZE = 64 * 1024
+DEF_SNIFF_SIZE = 4096
+
+FORMAT_M3U = 'm3u'
+FORMAT_TXT = 'txt'
+
+# 属性值中可能含有逗号, 引号内的内容整体匹配
+_re_extinf = re.compile(r'#EXTINF:([^,"]*(?:"[^"]*"[^,"]*)*),(.*)')
+_re_attr = re.compile(r'([\w-]+)\s*=\s*"([^"]*)"')
+_re_group_title = re.compile(r'group-title\s*=\s*"([^"]*)"', re.IGNORECASE)
+_sniff_m3u = (b'#EXTM3U', b'#EXTINF')
+
+
+def parse_attrs(extinf):
+    """
+    解析 #EXTINF 属性部分, 如 tvg-id tvg-name tvg-logo group-title
+    """
+    return {k.lower(): v.strip() for k, v in _re_attr.findall(extinf)}
+
+
+class PlaylistEntry(t.NamedTuple):
+    category: str
+    name: str
+    uri: str
+    extinf: str = ''
+
+    @property
+    def attrs(self):
+        return parse_attrs(self.extinf)
+
+
+def parse_extinf(line):
+    """
+    解析 #EXTINF 行, 返回 (属性部分, 频道名), 频道名为空时使用 tvg-name
+    """
+    m = _re_extinf.match(line)
+    if not m:
+        return None, None
+    extinf, name = m.group(1, 2)
+    name = name.strip()
+    if not name:
+        name = parse_attrs(extinf).get('tvg-name', '')
+    return extinf, name
+
+
+def sniff_format(head):
+    return FORMAT_M3U if any(s in head for s in _sniff_m3u) else FORMAT_TXT
+
+
+def iter_lines(chunks):
+    """
+    将按块读取的字节流拆分为解码后的行, 跨块的行会被拼接
+    """
+    pending = b''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8', 'replace').strip().lstrip('\ufeff')
+    if pending:
+        yield pending.decode('utf-8', 'replace').strip().lstrip('\ufeff')
+
+
+class Fingerprint:
+    """
+    按块增量计算的内容指纹, 忽略空行、行首尾空白及 #EXTM3U 头(常带有更新时间)
+    逐字转载或镜像的源得到相同的指纹; 跨块的行会被拼接, 只保留当前行
+    """
+    def __init__(self):
+        self._hash = hashlib.sha1()
+        self._pending = b''
+        self._digest = None
+
+    def _update_line(self, line):
+        line = line.strip().lstrip(b'\xef\xbb\xbf')
+        if line and not line.startswith(b'#EXTM3U'):
+            self._hash.update(line + b'\n')
+
+    def update(self, chunk):
+        lines = (self._pending + chunk).split(b'\n')
+        self._pending = lines.pop()
+        for line in lines:
+            self._update_line(line)
+
+    def wrap(self, chunks):
+        """
+        在数据块经过时更新指纹, 用于写入缓存或临时文件的同时计算
+        """
+        for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+
+    def hexdigest(self):
+        if self._digest is None:
+            self._update_line(self._pending)
+            self._pending = b''
+            self._digest = self._hash.hexdigest()
+        return self._digest
+
+
+def fingerprint(chunks: t.Iterable[bytes]):
+    fp = Fingerprint()
+    for chunk in chunks:
+        fp.update(chunk)
+    return fp.hexdigest()
+
+
+class PlaylistParser:
+    """
+    流式播放列表解析器, 从字节块迭代器中按需解析出 (分类, 频道名, 地址)
+    格式由开头的数据判断, 解析过程中只保留当前行, 内存占用与源大小无关
+    """
+    def __init__(self, chunks: t.Iterable[bytes], sniff_size=DEF_SNIFF_SIZE):
+        chunks = iter(chunks)
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= sniff_size:
+                break
+        self.format = sniff_format(b''.join(head).lstrip(b'\xef\xbb\xbf'))
+        self._chunks = head + [chunks]
+
+    def _iter_chunks(self):
+        for part in self._chunks:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                yield from part
+
+    def _parse_m3u(self, lines):
+        cate, name, extinf = '', None, ''
+        for line in lines:
+            if line[0] != '#':
+                if name:
+                    yield PlaylistEntry(cate, name, line, extinf)
+            elif line.startswith('#EXTINF'):
+                extinf, name = parse_extinf(line)
+                if name is not None:
+                    m = _re_group_title.search(extinf)
+                    cate = m.group(1).strip() if m else ''
+
+    def _parse_txt(self, lines):
+        cate = None
+        for line in lines:
+            name, sep, uri = line.partition(',')
+            if not sep:
+                continue
+            if '#genre#' in uri:
+                cate = name.strip()
+            elif cate:
+                name = name.strip()
+                uri = uri.strip()
+                if name and uri:
+                    yield PlaylistEntry(cate, name, uri)
+
+    def __iter__(self) -> t.Iterator[PlaylistEntry]:
+        lines = (l for l in iter_lines(self._iter_chunks()) if l)
+        if self.format == FORMAT_M3U:
+            return self._parse_m3u(lines)
+        return self._parse_txt(lines)
@@ -0,0 +1,212 @@
+import http.client
+import logging
+import socket
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urljoin
+
+DEF_PROBE_TIMEOUT = 5
+DEF_PROBE_WORKERS = 32
+DEF_PROBE_SEGMENT_BYTES = 512 * 1024
+DEF_PROBE_MANIFEST_BYTES = 1024 * 1024
+DEF_PROBE_MAX_REDIRECTS = 3
+DEF_PROBE_USER_AGENT = 'okhttp/4.12.0-iptv'
+
+_probe_schemes = ('http', 'https')
+_hls_content_types = ('mpegurl', 'x-mpegurl', 'vnd.apple.mpegurl')
+
+
+class ProbeError(Exception):
+    pass
+
+
+class ProbeResult:
+    """
+    单条线路的探测结果, 时间单位为秒, 吞吐量单位为 字节/秒
+    alive 为 None 表示协议不支持探测(rtmp/rtsp 等), 应保留线路但不参与排序比较
+    """
+    __slots__ = ('uri', 'alive', 'is_hls', 'connect_time', 'ttfb', 'manifest_time', 'throughput', 'error')
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.alive = None
+        self.is_hls = False
+        self.connect_time = None
+        self.ttfb = None
+        self.manifest_time = None
+        self.throughput = None
+        self.error = None
+
+    @property
+    def latency(self):
+        """
+        到可播放数据首字节的时间: HLS 为清单获取时间, 其它为首字节时间
+        """
+        if not self.alive:
+            return None
+        if self.is_hls and self.manifest_time is not None:
+            return self.manifest_time
+        return self.ttfb
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return f'<ProbeResult {self.uri} alive={self.alive} latency={self.latency} throughput={self.throughput}>'
+
+
+class StreamProber:
+    def __init__(self, timeout=DEF_PROBE_TIMEOUT, workers=DEF_PROBE_WORKERS,
+                 segment_bytes=DEF_PROBE_SEGMENT_BYTES, user_agent=DEF_PROBE_USER_AGENT):
+        self.timeout = timeout
+        self.workers = max(1, workers)
+        self.segment_bytes = segment_bytes
+        self.user_agent = user_agent
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ProbeError('timeout')
+        return remaining
+
+    def _open(self, url, deadline):
+        """
+        打开连接并发送 GET 请求, 跟随重定向
+        返回 (连接, 套接字, 响应, 最终地址, 连接耗时, 首字节耗时)
+        """
+        for _ in range(DEF_PROBE_MAX_REDIRECTS + 1):
+            p = urlparse(url)
+            if p.scheme not in _probe_schemes:
+                raise ProbeError(f'unsupported scheme: {p.scheme}')
+            conn_cls = http.client.HTTPSConnection if p.scheme == 'https' else http.client.HTTPConnection
+            kwargs = {'timeout': self._remaining(deadline)}
+            if p.scheme == 'https':
+                kwargs['context'] = ssl._create_unverified_context()
+            conn = conn_cls(p.hostname, p.port, **kwargs)
+
+            start = time.monotonic()
+            try:
+                conn.connect()
+                connect_time = time.monotonic() - start
+                sock = conn.sock
+                path = p.path or '/'
+                if p.query:
+                    path = f'{path}?{p.query}'
+                conn.request('GET', path, headers={'User-Agent': self.user_agent, 'Accept': '*/*'})
+                sock.settimeout(self._remaining(deadline))
+                res = conn.getresponse()
+                ttfb = time.monotonic() - start
+            except Exception:
+                conn.close()
+                raise
+
+            if res.status in (301, 302, 303, 307, 308) and res.getheader('Location'):
+                url = urljoin(url, res.getheader('Location'))
+                conn.close()
+                continue
+            if res.status >= 400:
+                conn.close()
+                raise ProbeError(f'http status: {res.status}')
+            return conn, sock, res, url, connect_time, ttfb
+        raise ProbeError('too many redirects')
+
+    def _read(self, sock, res, limit, deadline):
+        chunks = []
+        size = 0
+        while size < limit and not res.isclosed():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                chunk = res.read(min(64 * 1024, limit - size))
+            except (socket.timeout, TimeoutError):
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return b''.join(chunks)
+
+    def _fetch(self, url, deadline, limit):
+        conn, sock, res, url, connect_time, ttfb = self._open(url, deadline)
+        try:
+            body = self._read(sock, res, limit, deadline)
+        finally:
+            conn.close()
+        return res, url, body, connect_time, ttfb
+
+    def _is_hls(self, url, res):
+        content_type = (res.getheader('Content-Type') or '').lower()
+        return urlparse(url).path.endswith('.m3u8') or any(t in content_type for t in _hls_content_types)
+
+    def _next_uri(self, manifest):
+        """
+        返回清单中的第一个子地址以及其是否为子清单(多码率)
+        """
+        lines = [l.strip() for l in manifest.splitlines() if l.strip()]
+        if not lines or not lines[0].startswith('#EXTM3U'):
+            raise ProbeError('invalid playlist')
+        is_master = any(l.startswith('#EXT-X-STREAM-INF') for l in lines)
+        for l in lines:
+            if not l.startswith('#'):
+                return l, is_master
+        raise ProbeError('empty playlist')
+
+    def probe(self, uri):
+        result = ProbeResult(uri)
+        if urlparse(uri).scheme not in _probe_schemes:
+            return result
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+        try:
+            conn, sock, res, url, result.connect_time, result.ttfb = self._open(uri, deadline)
+            result.is_hls = self._is_hls(url, res)
+            if not result.is_hls:
+                # 非 HLS 直接以流本身的读取速度作为吞吐量
+                read_start = time.monotonic()
+                try:
+                    body = self._read(sock, res, self.segment_bytes, deadline)
+                finally:
+                    conn.close()
+                if not body:
+                    raise ProbeError('empty body')
+                result.throughput = len(body) / max(time.monotonic() - read_start, 1e-6)
+                result.alive = True
+                return result
+
+            try:
+                manifest = self._read(sock, res, DEF_PROBE_MANIFEST_BYTES, deadline)
+            finally:
+                conn.close()
+            segment, is_master = self._next_uri(manifest.decode('utf-8', 'ignore'))
+            depth = 0
+            while is_master and depth < 2:
+                _, url, manifest, _, _ = self._fetch(urljoin(url, segment), deadline, DEF_PROBE_MANIFEST_BYTES)
+                segment, is_master = self._next_uri(manifest.decode('utf-8', 'ignore'))
+                depth += 1
+            result.manifest_time = time.monotonic() - start
+
+            seg_start = time.monotonic()
+            _, _, body, _, _ = self._fetch(urljoin(url, segment), deadline, self.segment_bytes)
+            if not body:
+                raise ProbeError('empty segment')
+            result.throughput = len(body) / max(time.monotonic() - seg_start, 1e-6)
+            result.alive = True
+        except Exception as e:
+            result.alive = False
+            result.error = str(e) or e.__class__.__name__
+            logging.debug(f'线路探测失败: {uri} {result.error}')
+        return result
+
+    def probe_all(self, uris):
+        """
+        并发探测所有地址, 返回 {uri: ProbeResult}, 顺序与输入一致
+        """
+        uris = list(dict.fromkeys(uris))
+        if not uris:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(uris))) as executor:
+            return dict(zip(uris, executor.map(self.probe, uris)))
@@ -0,0 +1,226 @@
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from iptv import IPTV, RawLineWriter, logging, conv_bool, conv_list, conv_dict, DEF_FETCH_WORKERS
+from playlist import fingerprint, DEF_CHUNK_SIZE
+from epg import EPG, EPG_GZ_DISABLED
+from metrics import Metrics
+from health import BREAKER_OPEN, BREAKER_HALF_OPEN
+
+DEF_SCHEDULE_INTERVAL = 3600
+DEF_SCHEDULE_MIN_INTERVAL = 600
+DEF_SCHEDULE_MAX_INTERVAL = 6 * 3600
+DEF_SCHEDULE_EPG_INTERVAL = 6 * 3600
+DEF_SCHEDULE_MAX_SLEEP = 60
+
+
+class SourceState:
+    """
+    单个源的调度状态及最近一次的解析结果(按频道分组, 只保留需要的频道且已排除黑名单)
+    """
+    __slots__ = ('url', 'interval', 'fixed', 'next_run', 'digest', 'bytes', 'response_time', 'lines')
+
+    def __init__(self, url, interval, fixed=False):
+        self.url = url
+        self.interval = interval
+        self.fixed = fixed
+        self.next_run = 0
+        self.digest = None
+        self.bytes = 0
+        self.response_time = float('inf')
+        self.lines = {}
+
+    def reschedule(self, changed, now, min_interval, max_interval):
+        # 未单独配置间隔的源按内容变化的频率调整: 有变化时缩短, 无变化时延长
+        if not self.fixed:
+            if changed:
+                self.interval = max(min_interval, self.interval // 2)
+            else:
+                self.interval = min(max_interval, self.interval * 2)
+        self.next_run = now + self.interval
+
+
+class Scheduler:
+    """
+    常驻调度: 保持 IPTV 及 EPG 的状态, 每个源按各自的间隔刷新
+    源的内容有变化时只重新合并受影响的频道, 合并顺序及内容重复的源的处理与完整运行时相同, 结果一致
+    """
+    def __init__(self, iptv=None):
+        if iptv is None:
+            iptv = IPTV()
+            iptv.load_channels()
+        self.iptv = iptv
+        self.interval = iptv.get_config('schedule_interval', int, default=DEF_SCHEDULE_INTERVAL)
+        self.min_interval = iptv.get_config('schedule_min_interval', int, default=DEF_SCHEDULE_MIN_INTERVAL)
+        self.max_interval = iptv.get_config('schedule_max_interval', int, default=DEF_SCHEDULE_MAX_INTERVAL)
+        self.epg_interval = iptv.get_config('schedule_epg_interval', int, default=DEF_SCHEDULE_EPG_INTERVAL)
+        intervals = iptv.get_config('source_interval', conv_dict, default={})
+        self.sources = []
+        for url in iptv.get_config('source', conv_list, default=[]):
+            fixed = intervals.get(url) or intervals.get(urlparse(url).netloc)
+            try:
+                fixed = int(fixed) if fixed else None
+            except ValueError:
+                logging.error(f'源刷新间隔配置错误: {url} {fixed}')
+                fixed = None
+            self.sources.append(SourceState(url, fixed or self.interval, fixed is not None))
+        self.epg = None
+        self.epg_next_run = 0
+        workers = iptv.get_config('fetch_workers', int, default=DEF_FETCH_WORKERS)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(self.sources) or 1)))
+
+    def update_source(self, state, res, response_time):
+        """
+        内容有变化时重新解析, 返回受影响的频道; 无变化时返回 None
+        """
+        iptv = self.iptv
+        stats = iptv.begin_source(state.url, res, response_time)
+        state.response_time = response_time
+        # 指纹在下载的同时计算, 旧版本写入的缓存没有指纹时按块读取计算
+        digest = res.fingerprint or fingerprint(res.iter_content(DEF_CHUNK_SIZE))
+        if digest == state.digest:
+            logging.debug(f'源未变化: {state.url}')
+            stats.bytes = state.bytes
+            return None
+
+        start_time = time.perf_counter()
+        cache = iptv.parsed_cache
+        fmt, entries = iptv.source_entries(res, stats, cache.get(digest) if cache else None, digest)
+        lines = {}
+        try:
+            for prepared in entries:
+                if iptv.check_channel_uri(prepared[1], prepared[2], prepared[4], stats) is RawLineWriter.ACCEPTED:
+                    lines.setdefault(prepared[1], []).append(prepared)
+        finally:
+            entries.close()
+        state.bytes = stats.bytes
+        stats.parse_time += time.perf_counter() - start_time
+        iptv.metrics.add_time('parse', stats.parse_time)
+
+        if iptv.line_health:
+            iptv.line_health.record_seen(state.url, Counter((p[1], p[2]) for ps in lines.values() for p in ps))
+        affected = set(state.lines) | set(lines)
+        state.lines = lines
+        state.digest = digest
+        logging.info(f'源已更新: {fmt.upper()} {state.url}, 线路: {stats.lines_accepted}, 受影响的频道: {len(affected)}')
+        return affected
+
+    def refresh_sources(self, states, now):
+        iptv = self.iptv
+        # 在调度线程中打开源记录及解析结果缓存, 获取线程只读取
+        source_health = iptv.source_health
+        parsed_cache = iptv.open_parsed_cache()
+        futures = [self._executor.submit(iptv.fetch_source, s.url, True) for s in states]
+        affected = set()
+        for state, future in zip(states, futures):
+            res, response_time, breaker = future.result()
+            if breaker != BREAKER_OPEN and source_health:
+                ok = res is not None and not getattr(res, 'stale', False)
+                source_health.record(state.url, ok, response_time if ok else None)
+                if ok and breaker == BREAKER_HALF_OPEN:
+                    logging.info(f'源已恢复: {state.url}')
+            if res is None:
+                # 获取失败时保留上次的结果
+                iptv.metrics.source(state.url).response_time = response_time
+                state.next_run = now + state.interval
+                continue
+            try:
+                changed = self.update_source(state, res, response_time)
+            except Exception as e:
+                logging.error(f'解析源出错: {state.url} {e}')
+                changed = None
+            finally:
+                res.close()
+            state.reschedule(changed is not None, now, self.min_interval, self.max_interval)
+            if changed:
+                affected |= changed
+        if parsed_cache:
+            parsed_cache.evict()
+        return affected
+
+    def remerge(self, names):
+        """
+        按源的配置顺序重新合并指定的频道, 内容与靠前的源相同的源不再合并
+        """
+        iptv = self.iptv
+        states = self.sources
+        if iptv.get_config('dedup', conv_bool, default=True):
+            states = []
+            digests = set()
+            for state in self.sources:
+                if state.digest is not None and state.digest not in digests:
+                    digests.add(state.digest)
+                    states.append(state)
+        for name in names:
+            iptv.channels[name].clear()
+            for state in states:
+                for prepared in state.lines.get(name, ()):
+                    iptv.accept_channel_uri(*prepared, state.response_time, state.url)
+
+    def refresh_epg(self):
+        epg = EPG(self.iptv)
+        epg.fetch_epg()
+        if epg.epg_doc is None:
+            logging.warning('EPG 获取失败, 继续使用上次的内容')
+            return False
+        epg.normalize()
+        self.epg = epg
+        return True
+
+    def tick(self, now=None):
+        """
+        刷新到期的源及 EPG, 返回 (播放列表是否变化, EPG 是否变化)
+        """
+        now = now or time.time()
+        iptv = self.iptv
+        iptv.metrics = Metrics('iptv')
+        due = [s for s in self.sources if s.next_run <= now]
+        affected = self.refresh_sources(due, now) if due else set()
+        if affected:
+            with iptv.metrics.stage('merge'):
+                self.remerge(affected)
+            iptv.probe_channels(affected)
+            iptv.sort_channels_by_response_time(affected)
+            iptv.stat_fetched_channels()
+
+        epg_changed = False
+        links_changed = False
+        if now >= self.epg_next_run:
+            epg_changed = self.refresh_epg()
+            self.epg_next_run = now + self.epg_interval
+            if epg_changed:
+                # 播放列表中的 tvg-id 随 EPG 的频道变化
+                links_changed = iptv.link_epg(self.epg.channel_ids())
+        return bool(affected) or links_changed, epg_changed
+
+    def wait_time(self):
+        next_run = min([s.next_run for s in self.sources] + [self.epg_next_run])
+        return min(DEF_SCHEDULE_MAX_SLEEP, max(1, next_run - time.time()))
+
+    def export(self, playlist_changed, epg_changed):
+        iptv = self.iptv
+        if playlist_changed:
+            iptv.export()
+            iptv.export_metrics()
+        if epg_changed:
+            self.epg.export(xml_gz=not EPG_GZ_DISABLED)
+            iptv.export_metrics(self.epg.metrics, prefix='epg-')
+
+    def run_forever(self, stop=None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.export(*self.tick())
+            except Exception as e:
+                logging.error(f'调度出错: {e}')
+            stop.wait(self.wait_time())
+
+
+if __name__ == '__main__':
+    try:
+        Scheduler().run_forever()
+    except KeyboardInterrupt:
+        pass
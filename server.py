@@ -0,0 +1,297 @@
+import re
+import io
+import time
+import gzip
+import hashlib
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, unquote, quote
+
+from iptv import IPTV, logging, conv_bool, DEF_IPV4_FILENAME_SUFFIX
+from epg import EPG_GZ_LEVEL, DEF_EPG_SHARD_DIR
+from scheduler import Scheduler
+
+DEF_SERVE_HOST = '0.0.0.0'
+DEF_SERVE_PORT = 8080
+DEF_GZIP_LEVEL = 6
+DEF_GZIP_MIN_SIZE = 1024
+
+_re_range = re.compile(r'bytes=(\d*)-(\d*)$')
+
+_content_types = {
+    '.m3u': 'audio/x-mpegurl; charset=utf-8',
+    '.txt': 'text/plain; charset=utf-8',
+    '.xml': 'application/xml; charset=utf-8',
+    '.gz': 'application/gzip',
+    '.prom': 'text/plain; version=0.0.4; charset=utf-8',
+    '.json': 'application/json; charset=utf-8',
+}
+
+
+class Asset:
+    """
+    预先编码的响应内容, 同时保存原始及 gzip 压缩后的数据
+    """
+    __slots__ = ('body', 'gzip_body', 'etag', 'content_type', 'last_modified')
+
+    def __init__(self, body, content_type, gzip_body=None, last_modified=None):
+        self.body = body
+        self.gzip_body = gzip_body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        self.content_type = content_type
+        self.last_modified = last_modified or time.time()
+
+    @classmethod
+    def build(cls, path, body, level=DEF_GZIP_LEVEL, **kwargs):
+        content_type = _content_types.get('.' + path.rsplit('.', 1)[-1], 'application/octet-stream')
+        gzip_body = None
+        if len(body) >= DEF_GZIP_MIN_SIZE and not path.endswith('.gz'):
+            gzip_body = gzip.compress(body, compresslevel=level, mtime=0)
+        return cls(body, content_type, gzip_body, **kwargs)
+
+
+class Snapshot:
+    """
+    某一时刻的全部响应内容, 创建后不再修改; 刷新时构建新的快照再整体替换
+    """
+    __slots__ = ('assets', 'iptv_time', 'epg_time')
+
+    def __init__(self, assets=None, iptv_time=0, epg_time=0):
+        self.assets = assets or {}
+        self.iptv_time = iptv_time
+        self.epg_time = epg_time
+
+    def get(self, path):
+        return self.assets.get(path)
+
+
+def build_iptv_assets(iptv):
+    """
+    由内存中的频道数据生成全部播放列表, 包括仅 IPv4 版本及各分类的播放列表
+    """
+    assets = {}
+    now = time.time()
+    for prefix, cates in [('/live', None)] + [(f'/cate/{cate}', {cate}) for cate in iptv.channel_cates]:
+        # 每组的四个播放列表遍历一次生成
+        buffers = {(fmt, ipv4_only): io.StringIO() for fmt in ('m3u', 'txt') for ipv4_only in (False, True)}
+        iptv.render([(fmt, ipv4_only, buf) for (fmt, ipv4_only), buf in buffers.items()], cates)
+        for (fmt, ipv4_only), buf in buffers.items():
+            suffix = DEF_IPV4_FILENAME_SUFFIX if ipv4_only else ''
+            assets[f'{prefix}{suffix}.{fmt}'] = Asset.build(f'.{fmt}', buf.getvalue().encode('utf-8'), last_modified=now)
+    return assets
+
+
+def build_epg_assets(epg):
+    with epg.metrics.stage('serialize'):
+        now = time.time()
+        body = epg.dumpb()
+        gzip_body = gzip.compress(body, compresslevel=EPG_GZ_LEVEL, mtime=0)
+        xml = Asset(body, _content_types['.xml'], gzip_body, last_modified=now)
+        xml_gz = Asset(gzip_body, _content_types['.gz'], last_modified=now)
+        assets = {'/epg.xml': xml, '/epg.xml.gz': xml_gz}
+        if epg.iptv.get_config('epg_shard', conv_bool, default=False):
+            for filename, body in epg.iter_shards():
+                assets[f'/{DEF_EPG_SHARD_DIR}/{filename}'] = Asset.build(filename, body, last_modified=now)
+    return assets
+
+
+class SnapshotRefresher:
+    """
+    后台刷新: 由调度器按各源的间隔刷新, 有变化时构建新快照并原子替换, 构建期间继续使用旧快照响应请求
+    没有变化的部分沿用旧快照中的内容
+    """
+    def __init__(self):
+        self.scheduler = None
+        self.snapshot = None
+        self._metrics = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def build(self, previous, playlist_changed, epg_changed):
+        now = time.time()
+        scheduler = self.scheduler
+        assets = dict(previous.assets) if previous is not None else {}
+        iptv_time = previous.iptv_time if previous is not None else 0
+        epg_time = previous.epg_time if previous is not None else 0
+        if playlist_changed:
+            iptv = scheduler.iptv
+            with iptv.metrics.stage('export'):
+                assets.update(build_iptv_assets(iptv))
+            iptv.metrics.finish(iptv.line_sources())
+            self._metrics['iptv'] = iptv.metrics.to_prometheus()
+            iptv_time = now
+        if epg_changed:
+            # 不再存在的频道的 EPG 文件
+            for path in [p for p in assets if p.startswith(f'/{DEF_EPG_SHARD_DIR}/')]:
+                del assets[path]
+            assets.update(build_epg_assets(scheduler.epg))
+            scheduler.epg.metrics.finish()
+            self._metrics['epg'] = scheduler.epg.metrics.to_prometheus()
+            epg_time = now
+        assets['/metrics'] = Asset.build('.prom', ''.join(self._metrics.values()).encode('utf-8'))
+        return Snapshot(assets, iptv_time, epg_time)
+
+    def refresh_once(self):
+        start_time = time.time()
+        try:
+            if self.scheduler is None:
+                # 在刷新线程中创建, 线路及源记录的数据库连接只在该线程中使用
+                self.scheduler = Scheduler()
+            playlist_changed, epg_changed = self.scheduler.tick()
+            if not playlist_changed and not epg_changed and self.snapshot is not None:
+                return False
+            snapshot = self.build(self.snapshot, playlist_changed, epg_changed)
+        except Exception as e:
+            logging.error(f'刷新失败, 继续使用旧内容: {e}')
+            return False
+        self.snapshot = snapshot
+        logging.info(f'刷新完毕: 内容: {len(snapshot.assets)}, 耗时: {time.time() - start_time:.2f}s')
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh_once()
+            self._stop.wait(self.scheduler.wait_time() if self.scheduler is not None else 30)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def parse_range(value, size):
+    """
+    解析单个 Range, 返回 (开始, 结束) (含结束位置); 不支持或无法满足时分别返回 None 及 False
+    """
+    m = _re_range.match(value.strip())
+    if not m:
+        return None
+    if not size:
+        return False
+    first, last = m.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if not length:
+            return False
+        return max(0, size - length), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        return False
+    return first, last
+
+
+def etag_matches(header, etag):
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+class PlaylistRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'iptv'
+    refresher: SnapshotRefresher = None
+
+    def log_message(self, format, *args):
+        logging.debug(f'{self.address_string()} {format % args}')
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _index(self, snapshot):
+        paths = sorted(snapshot.assets)
+        return Asset.build('.txt', ''.join(f'{quote(p)}\n' for p in paths).encode('utf-8'))
+
+    def _handle(self, head=False):
+        snapshot = self.refresher.snapshot
+        if snapshot is None:
+            return self._send_empty(503, {'Retry-After': '30'})
+        path = unquote(urlparse(self.path).path)
+        asset = self._index(snapshot) if path == '/' else snapshot.get(path)
+        if asset is None:
+            return self._send_empty(404)
+
+        use_gzip = asset.gzip_body is not None and 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = asset.gzip_body if use_gzip else asset.body
+        etag = f'{asset.etag[:-1]}-gz"' if use_gzip else asset.etag
+        headers = {
+            'ETag': etag,
+            'Last-Modified': formatdate(asset.last_modified, usegmt=True),
+            'Cache-Control': 'no-cache',
+            'Accept-Ranges': 'bytes',
+        }
+        if asset.gzip_body is not None:
+            headers['Vary'] = 'Accept-Encoding'
+
+        inm = self.headers.get('If-None-Match')
+        if inm is not None:
+            if etag_matches(inm, etag):
+                return self._send_empty(304, headers)
+        elif self.headers.get('If-Modified-Since'):
+            try:
+                if int(asset.last_modified) <= parsedate_to_datetime(self.headers['If-Modified-Since']).timestamp():
+                    return self._send_empty(304, headers)
+            except (TypeError, ValueError):
+                pass
+
+        status = 200
+        start, end = 0, len(body) - 1
+        value = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if value and (if_range is None or if_range.strip() == etag):
+            r = parse_range(value, len(body))
+            if r is False:
+                headers['Content-Range'] = f'bytes */{len(body)}'
+                return self._send_empty(416, headers)
+            if r is not None:
+                status = 206
+                start, end = r
+                headers['Content-Range'] = f'bytes {start}-{end}/{len(body)}'
+
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Type', asset.content_type)
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not head:
+            self.wfile.write(memoryview(body)[start:end + 1])
+
+    def do_GET(self):
+        self._handle()
+
+    def do_HEAD(self):
+        self._handle(head=True)
+
+
+def serve():
+    iptv = IPTV()
+    host = iptv.get_config('serve_host', default=DEF_SERVE_HOST)
+    port = iptv.get_config('serve_port', int, default=DEF_SERVE_PORT)
+    refresher = SnapshotRefresher()
+    handler = type('Handler', (PlaylistRequestHandler,), {'refresher': refresher})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    refresher.start()
+    logging.info(f'服务已启动: http://{host}:{port}/')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        refresher.stop()
+        httpd.server_close()
+
+
+if __name__ == '__main__':
+    serve()
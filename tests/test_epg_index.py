@@ -0,0 +1,86 @@
+"""
+节目索引测试: 随机的节目单按时间窗口查找及裁剪, 与逐个判断的结果比较
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import random
+import datetime
+import unittest
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epg import ProgrammeIndex, parse_xmltv_time
+
+BASE = 1704067200
+CHANNELS = ('a', 'b', 'c')
+
+
+def xmltv_time(ts):
+    if ts is None:
+        return 'unknown'
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y%m%d%H%M%S +0000')
+
+
+def random_root(rnd):
+    root = ET.Element('tv')
+    for cid in CHANNELS:
+        ET.SubElement(root, 'channel', id=cid)
+    for i in range(rnd.randint(0, 40)):
+        start = None if rnd.random() < 0.1 else BASE + rnd.randint(0, 100) * 60
+        if rnd.random() < 0.1:
+            stop = None
+        elif start is None:
+            stop = BASE + rnd.randint(0, 120) * 60
+        else:
+            # 含长节目, 使其后的短节目先于其结束
+            stop = start + rnd.choice((0, 5, 30, 300)) * 60
+        ET.SubElement(root, 'programme', channel=rnd.choice(CHANNELS), start=xmltv_time(start),
+                      stop=xmltv_time(stop), id=str(i))
+    return root
+
+
+def expected(root, cid, start, end):
+    # 时间无法解析的节目始终保留
+    ids = set()
+    for elem in root.iter('programme'):
+        if elem.get('channel') != cid:
+            continue
+        s, e = parse_xmltv_time(elem.get('start')), parse_xmltv_time(elem.get('stop'))
+        if s is None or ((end is None or s < end) and (start is None or s >= start or e is None or e > start)):
+            ids.add(elem.get('id'))
+    return ids
+
+
+class ProgrammeIndexTest(unittest.TestCase):
+    def test_parse_time(self):
+        self.assertEqual(parse_xmltv_time('20240101080000 +0800'), BASE)
+        self.assertEqual(parse_xmltv_time('20240101080000+0800'), BASE)
+        self.assertEqual(parse_xmltv_time('20240101000000'), BASE)
+        self.assertIsNone(parse_xmltv_time('unknown'))
+
+    def test_random_windows(self):
+        rnd = random.Random(1)
+        for _ in range(300):
+            root = random_root(rnd)
+            index = ProgrammeIndex(root)
+            start = rnd.choice((None, BASE + rnd.randint(0, 120) * 60))
+            end = rnd.choice((None, BASE + rnd.randint(0, 120) * 60))
+            for cid in CHANNELS + ('missing',):
+                got = [e.get('id') for e in index.get(cid, start, end)]
+                self.assertEqual(len(got), len(set(got)))
+                self.assertEqual(set(got), expected(root, cid, start, end))
+
+            total = len(index)
+            removed = index.prune(start, end)
+            self.assertEqual(len(index), total - removed)
+            for cid in CHANNELS:
+                self.assertEqual({e.get('id') for e in index.get(cid)}, expected(root, cid, start, end))
+                # 裁剪后再次查找同一窗口结果不变
+                self.assertEqual({e.get('id') for e in index.get(cid, start, end)}, expected(root, cid, start, end))
+
+
+if __name__ == '__main__':
+    unittest.main()
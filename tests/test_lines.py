@@ -0,0 +1,64 @@
+"""
+线路集合测试: 随机的线路序列分别加入限制及不限制数量的 ChannelLines, 验证导出的线路一致, 及内存上限
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iptv import ChannelLines, DEF_WHITELIST_PRIORITY
+
+
+def sort_key(line):
+    # 与导出排序一致(未探测): 响应时间优先, 其次优先级
+    return line.response_time, -line.priority
+
+
+def snapshot(lines):
+    lines.sort(sort_key)
+    return [(l.uri, l.count, l.priority, l.response_time) for l in lines.best()]
+
+
+class ChannelLinesTest(unittest.TestCase):
+    def test_reaccepted_line(self):
+        # 被淘汰的线路保留累计的出现次数, 再次出现后优先级更高, 替换保留的线路
+        lines = ChannelLines(limit=1)
+        lines.add('x', response_time=1)
+        self.assertIsNone(lines.add('y', response_time=1))
+        self.assertIsNotNone(lines.add('y', response_time=1))
+        self.assertEqual(snapshot(lines), [('y', 2, 2, 1)])
+
+    def test_random_against_unlimited(self):
+        rnd = random.Random(1)
+        for _ in range(300):
+            limit, reserve = rnd.randint(1, 5), rnd.randint(0, 3)
+            capacity = limit + reserve
+            # 同一线路的优先级(是否在白名单中)固定, 不同地址不超过 2 * capacity 时结果一致
+            priorities = {f'http://{i}': rnd.choice((0, DEF_WHITELIST_PRIORITY))
+                          for i in range(rnd.randint(1, 2 * capacity))}
+            uris = list(priorities)
+            bounded, unbounded = ChannelLines(limit, reserve), ChannelLines()
+            for _ in range(rnd.randint(1, 60)):
+                uri = rnd.choice(uris)
+                response_time = rnd.choice((0.1, 0.2, 0.5, 1.0))
+                bounded.add(uri, priorities[uri], response_time)
+                unbounded.add(uri, priorities[uri], response_time)
+            unbounded.limit = limit
+            self.assertEqual(snapshot(bounded), snapshot(unbounded))
+
+    def test_memory_bound(self):
+        rnd = random.Random(2)
+        lines = ChannelLines(limit=5, reserve=3)
+        for i in range(20000):
+            lines.add(f'http://{rnd.randrange(5000)}', 0, rnd.random())
+            self.assertLessEqual(len(lines), lines.capacity)
+            self.assertLessEqual(len(lines._evicted), lines.capacity)
+            self.assertLessEqual(len(lines._evicted_heap), 4 * lines.capacity + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
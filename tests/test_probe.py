@@ -0,0 +1,132 @@
+"""
+线路探测测试: 本地 HTTP 服务提供清单及分片, 验证可用、不可用及超时的判断
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from probe import StreamProber
+
+SEGMENT = b'\x47' * (188 * 1000)
+
+# 路径 => (内容, Content-Type, 响应前的延迟)
+FILES = {
+    '/live/master.m3u8': (b'#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nlow/index.m3u8\n', 'application/vnd.apple.mpegurl', 0),
+    '/live/low/index.m3u8': (b'#EXTM3U\n#EXT-X-TARGETDURATION:10\n#EXTINF:10,\nseg-1.ts\n', 'application/vnd.apple.mpegurl', 0),
+    '/live/low/seg-1.ts': (SEGMENT, 'video/mp2t', 0),
+    '/stream': (SEGMENT, 'video/x-flv', 0),
+    '/redirect.m3u8': (None, None, 0),
+    '/dead/index.m3u8': (b'#EXTM3U\n#EXTINF:10,\nmissing.ts\n', 'application/vnd.apple.mpegurl', 0),
+    '/empty.m3u8': (b'#EXTM3U\n', 'application/vnd.apple.mpegurl', 0),
+    '/html.m3u8': (b'<html></html>', 'application/vnd.apple.mpegurl', 0),
+    '/slow.m3u8': (b'#EXTM3U\n#EXTINF:10,\nlive/low/seg-1.ts\n', 'application/vnd.apple.mpegurl', 2),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/redirect.m3u8':
+            self.send_response(302)
+            self.send_header('Location', '/live/master.m3u8')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body, content_type, delay = FILES.get(self.path, (None, None, 0))
+        if delay:
+            time.sleep(delay)
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StreamProberTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.httpd.daemon_threads = True
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.httpd.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def probe(self, path, timeout=3):
+        return StreamProber(timeout=timeout, workers=4).probe(f'{self.base_url}{path}')
+
+    def test_hls_master_playlist(self):
+        result = self.probe('/live/master.m3u8')
+        self.assertTrue(result.alive, result.error)
+        self.assertTrue(result.is_hls)
+        self.assertIsNotNone(result.manifest_time)
+        self.assertEqual(result.latency, result.manifest_time)
+        self.assertGreater(result.throughput, 0)
+
+    def test_redirect(self):
+        result = self.probe('/redirect.m3u8')
+        self.assertTrue(result.alive, result.error)
+        self.assertTrue(result.is_hls)
+
+    def test_plain_stream(self):
+        result = self.probe('/stream')
+        self.assertTrue(result.alive, result.error)
+        self.assertFalse(result.is_hls)
+        self.assertEqual(result.latency, result.ttfb)
+        self.assertGreater(result.throughput, 0)
+
+    def test_missing_manifest(self):
+        result = self.probe('/missing.m3u8')
+        self.assertFalse(result.alive)
+        self.assertIsNone(result.latency)
+        self.assertIn('404', result.error)
+
+    def test_missing_segment(self):
+        result = self.probe('/dead/index.m3u8')
+        self.assertFalse(result.alive)
+        self.assertIn('404', result.error)
+
+    def test_invalid_playlist(self):
+        self.assertEqual(self.probe('/empty.m3u8').error, 'empty playlist')
+        self.assertEqual(self.probe('/html.m3u8').error, 'invalid playlist')
+
+    def test_timeout(self):
+        start = time.monotonic()
+        result = self.probe('/slow.m3u8', timeout=0.5)
+        self.assertFalse(result.alive)
+        self.assertIsNotNone(result.error)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_unsupported_scheme(self):
+        result = StreamProber().probe('rtmp://127.0.0.1/live/stream')
+        self.assertIsNone(result.alive)
+        self.assertIsNone(result.error)
+
+    def test_probe_all(self):
+        uris = [f'{self.base_url}/live/master.m3u8', f'{self.base_url}/missing.m3u8', f'{self.base_url}/live/master.m3u8']
+        results = StreamProber(timeout=3, workers=4).probe_all(uris)
+        self.assertEqual(list(results), uris[:2])
+        self.assertEqual([r.alive for r in results.values()], [True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
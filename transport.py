@@ -0,0 +1,223 @@
+import time
+import socket
+import logging
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+DEF_DNS_TTL = 300
+DEF_POOL_HOSTS = 32
+DEF_POOL_SIZE = 4
+DEF_ACCEPT_ENCODING = 'gzip, deflate'
+
+_local = threading.local()
+
+
+class RequestTiming:
+    """
+    单次请求的耗时分解(秒), 复用连接时 dns/connect/tls 为 0
+    """
+    __slots__ = ('dns', 'connect', 'tls', 'ttfb', 'transfer', 'reused')
+
+    def __init__(self):
+        self.dns = 0.0
+        self.connect = 0.0
+        self.tls = 0.0
+        self.ttfb = 0.0
+        self.transfer = 0.0
+        self.reused = True
+
+    @property
+    def total(self):
+        return self.dns + self.connect + self.tls + self.ttfb + self.transfer
+
+    def as_dict(self):
+        return {k: getattr(self, k) if k == 'reused' else round(getattr(self, k), 6) for k in self.__slots__}
+
+
+class DNSCache:
+    """
+    进程内的 DNS 缓存, 多个源共用少数几个主机时避免重复解析
+    """
+    def __init__(self, ttl=DEF_DNS_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and now - entry[0] < self.ttl:
+            return entry[1]
+        addrs = []
+        for *_, sockaddr in socket.getaddrinfo(host.strip('[]'), port, 0, socket.SOCK_STREAM):
+            if sockaddr[0] not in addrs:
+                addrs.append(sockaddr[0])
+        with self._lock:
+            self._entries[key] = (now, addrs)
+        return addrs
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+dns_cache = DNSCache()
+
+
+class _TimedConnectionMixin:
+    # 新建连接时经由 DNS 缓存解析, 并将各阶段耗时记录到当前线程的请求上
+    def _new_conn(self):
+        timing = getattr(_local, 'timing', None)
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            addrs = dns_cache.resolve(host, self.port)
+        except OSError:
+            # 交由 urllib3 解析并抛出相应的异常
+            addrs = [host]
+        resolved = time.perf_counter()
+        error = None
+        try:
+            for addr in addrs:
+                self._dns_host = addr
+                try:
+                    sock = super()._new_conn()
+                    break
+                except Exception as e:
+                    error = e
+            else:
+                raise error
+        finally:
+            self._dns_host = host
+            self._new_conn_time = time.perf_counter() - start
+            if timing is not None:
+                timing.reused = False
+                timing.dns += resolved - start
+                timing.connect += time.perf_counter() - resolved
+        return sock
+
+    def connect(self):
+        self._new_conn_time = 0.0
+        start = time.perf_counter()
+        super().connect()
+        timing = getattr(_local, 'timing', None)
+        if timing is not None and isinstance(self, HTTPSConnection):
+            timing.tls += time.perf_counter() - start - self._new_conn_time
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+_pool_classes = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _pool_classes
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if not proxy.lower().startswith('socks'):
+            manager.pool_classes_by_scheme = _pool_classes
+        return manager
+
+
+class Transport:
+    """
+    iptv.py 与 epg.py 共用的 HTTP 传输层:
+    共享的 Session 按主机保持连接池, 协商 gzip/deflate 压缩, 经由 DNS 缓存解析, 可按源设置代理及 User-Agent
+    响应内容流式读取, 并记录每次请求的耗时分解
+    """
+    def __init__(self, user_agent, pool_size=DEF_POOL_SIZE, pool_hosts=DEF_POOL_HOSTS, proxy=None,
+                 source_proxies=None, source_user_agents=None):
+        self.user_agent = user_agent
+        self.proxy = proxy
+        self.source_proxies = source_proxies or {}
+        self.source_user_agents = source_user_agents or {}
+        self.session = requests.Session()
+        adapter = TimedHTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'User-Agent': user_agent, 'Accept-Encoding': DEF_ACCEPT_ENCODING})
+
+    def _lookup(self, mapping, url):
+        # 依次按完整地址、主机:端口、主机查找
+        if not mapping:
+            return None
+        if url in mapping:
+            return mapping[url]
+        p = urlparse(url)
+        return mapping.get(p.netloc) or mapping.get(p.hostname)
+
+    def get(self, url, headers=None, timeout=None):
+        """
+        发起流式请求, 返回的响应上附加 timing, 需通过 iter_content 读取以记录传输耗时
+        """
+        headers = dict(headers or {})
+        user_agent = self._lookup(self.source_user_agents, url)
+        if user_agent:
+            headers['User-Agent'] = user_agent
+        proxy = self._lookup(self.source_proxies, url) or self.proxy
+        proxies = {'http': proxy, 'https': proxy} if proxy else None
+
+        timing = _local.timing = RequestTiming()
+        start = time.perf_counter()
+        try:
+            res = self.session.get(url, headers=headers, timeout=timeout, proxies=proxies, stream=True)
+        finally:
+            _local.timing = None
+        timing.ttfb = max(0.0, time.perf_counter() - start - timing.dns - timing.connect - timing.tls)
+        res.timing = timing
+        return res
+
+    @staticmethod
+    def iter_content(res, chunk_size):
+        # 只计入读取响应的时间, 不含调用方处理数据的时间
+        timing = getattr(res, 'timing', None)
+        chunks = res.iter_content(chunk_size)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            if timing is not None:
+                timing.transfer += time.perf_counter() - start
+            if chunk is None:
+                break
+            yield chunk
+
+    def close(self):
+        self.session.close()
+
+
+def parse_source_options(lines):
+    """
+    解析按源设置的选项, 每行为 "地址或主机 值", 值中可以含有空格(如 User-Agent)
+    """
+    options = {}
+    for line in lines:
+        parts = line.split(None, 1)
+        if len(parts) != 2:
+            logging.error(f'源选项配置错误: {line}')
+            continue
+        options[parts[0]] = parts[1].strip()
+    return options